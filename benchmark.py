@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import tempfile
+import argparse
+import subprocess
+from datetime import datetime
+from multiprocessing import Process, Value
+import cv2
+import numpy as np
+
+from utils.synthetic import make_session, StubDetector
+from utils.profiler import StageProfiler, machine_info
+
+def default_workdir():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'semi-autolabeling', 'benchmark')
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def first_frames(videos):
+    frames = []
+    for video in videos:
+        cap = cv2.VideoCapture(video)
+        success, frame = cap.read()
+        cap.release()
+        if not success:
+            raise Exception(f"Couldn't read {video}")
+        frames.append(frame)
+    return frames
+
+def bench_tracking(videos, detect_stride=1, latency_ms=0):
+    """Frames per second of track_session over all the cameras with the stub detector, and its stage times"""
+    from utils.tracking import track_session, tracker_params
+    profiler = StageProfiler(len(videos))
+    start = time.perf_counter()
+    track_session(videos, 100, None, 0.2, 0.75, tracker_params(), [dict() for _ in videos], None, Value('b', True), Value('i', 0), detect_stride=detect_stride, profiler=profiler, model=StubDetector(latency_ms))
+    elapsed = time.perf_counter()-start
+    frames = sum([row["count"] for row in profiler.summary() if row["stage"] == 'decode'])
+    return {"fps": frames/elapsed, "camera_frames": frames, "seconds": elapsed, "stages_ms": {stage: mean for stage, _, mean, _ in profiler.stage_totals()}}
+
+def feed_ring(ring, frame, count, running):
+    """Producer of bench_queue: sends `count` frames stamped with the time they were put"""
+    for cnt in range(count):
+        if not ring.put((frame, [], [], cnt, time.time(), None), running=running):
+            break
+    ring.put(None)
+
+def bench_queue(shape, count=300, depth=8):
+    """Time from the tracker process putting a sampled frame in its shared-memory ring to the review page
+    getting it, with the review page always waiting"""
+    from utils.frame_ring import SharedFrameRing
+    ring = SharedFrameRing(shape, depth)
+    running = Value('b', True)
+    producer = Process(target=feed_ring, args=(ring, np.zeros(shape, dtype=np.uint8), count, running))
+    start = time.perf_counter()
+    producer.start()
+    latencies = []
+    while True:
+        item = ring.get()
+        if item is None:
+            break
+        latencies.append(time.time()-item[4])
+    elapsed = time.perf_counter()-start
+    producer.join()
+    ring.close()
+    latencies = np.array(latencies)*1000
+    return {"frames_per_s": len(latencies)/elapsed, "latency_mean_ms": float(latencies.mean()), "latency_p50_ms": float(np.percentile(latencies, 50)), "latency_p95_ms": float(np.percentile(latencies, 95))}
+
+def bench_render(videos, loops=200, size=(1920, 1080)):
+    """Review page drawing, offscreen: a loop drawing the cached grid (what App.run does between Confirms),
+    a loop with new frames on every tile (after Confirm) and the ClickableArea redraw after a name change"""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    pygame.init()
+    screen = pygame.display.set_mode(size)
+    from utils.ui_utils import FrameTile, ClickableArea
+    detector = StubDetector()
+    frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in first_frames(videos)]
+    boxes = [[[(x1+x2)/2, (y1+y2)/2, x2-x1, y2-y1] for x1, y1, x2, y2, _, _ in detector.detect(frame)] for frame in first_frames(videos)]
+    n = int(np.ceil(np.sqrt(len(videos))))
+    h = .9*size[1]/n-(n-1)*.01*size[1]
+    w = (5/4)*h
+    tiles = [FrameTile() for _ in videos]
+    areas = [ClickableArea(0, 0, frame.shape[1], frame.shape[0], rects, {i: f'name {i}' for i in range(len(rects))}, list(range(len(rects))), {i: (250, 50, 100) for i in range(len(rects))}) for frame, rects in zip(frames, boxes)]
+
+    def draw():
+        screen.fill((255, 255, 255))
+        for i in range(len(videos)):
+            tile = tiles[i].get(frames[i], (w, h))
+            x, y = (i%n)*(w+.01*size[1]), .05*size[1]+(i//n)*(h+.01*size[1])
+            screen.blit(tile, (x, y))
+            areas[i].draw(screen, x, y, tile.get_width(), tile.get_height())
+
+    def timed(prepare):
+        draw()    # warm-up
+        elapsed = 0
+        for _ in range(loops):
+            prepare()
+            start = time.perf_counter()
+            draw()
+            elapsed += time.perf_counter()-start
+        return elapsed*1000/loops
+
+    def new_frames():
+        for i in range(len(frames)):
+            frames[i] = frames[i].copy()
+            areas[i].update()
+
+    def new_names():
+        for area in areas:
+            area.update()
+
+    report = {"grid_ms": timed(lambda: None), "new_frames_ms": timed(new_frames), "names_ms": timed(new_names)}
+    pygame.quit()
+    return report
+
+def bench_export(videos, crops=2000, formats=(('png', 'files'), ('jpg', 'files'), ('jpg', 'tar'))):
+    """Crops per second written by CropWriter, from submit to close, per format and container"""
+    from utils.export import CropWriter
+    frame = first_frames(videos[:1])[0]
+    rects = [[(x1+x2)/2, (y1+y2)/2, x2-x1, y2-y1] for x1, y1, x2, y2, _, _ in StubDetector().detect(frame)]
+    report = {}
+    for fmt, container in formats:
+        with tempfile.TemporaryDirectory() as folder:
+            writer = CropWriter(folder, fmt=fmt, quality=95, container=container)
+            start = time.perf_counter()
+            for i in range(crops):
+                writer.submit(frame, rects[i%len(rects)], f'animal_{i%len(rects)}', str(i), rgb=False)
+            writer.close()
+            report[f"{fmt}_{container}_crops_per_s"] = crops/(time.perf_counter()-start)
+    return report
+
+def flatten(results, prefix=''):
+    metrics = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            metrics.update(flatten(value, prefix+key+'.'))
+        elif isinstance(value, (int, float)):
+            metrics[prefix+key] = value
+    return metrics
+
+def compare(old, new):
+    """Relative change of every metric two reports have in common"""
+    old_metrics, new_metrics = flatten(old["results"]), flatten(new["results"])
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    for key in sorted(set(old_metrics) & set(new_metrics)):
+        change = (new_metrics[key]-old_metrics[key])/old_metrics[key]*100 if old_metrics[key] != 0 else 0
+        print(f"{key:<45}{old_metrics[key]:>12.2f}{new_metrics[key]:>12.2f}{change:>+9.1f}%")
+
+def run(workdir=None, cameras=4, frames=300, width=1280, height=720, animals=5, seed=0, latency_ms=0, detect_stride=1, only=None):
+    """Runs the benchmarks on a synthetic session and returns the report. A benchmark whose dependencies are
+    missing is reported as skipped."""
+    videos = make_session(workdir if workdir is not None else default_workdir(), cameras, frames, (width, height), animals, seed=seed)
+    benchmarks = {
+        "tracking": lambda: bench_tracking(videos, detect_stride, latency_ms),
+        "queue": lambda: bench_queue((height, width, 3)),
+        "render": lambda: bench_render(videos),
+        "export": lambda: bench_export(videos),
+    }
+    results = {}
+    for name, benchmark in benchmarks.items():
+        if only is not None and name not in only:
+            continue
+        print(f"Running {name} ...")
+        try:
+            results[name] = benchmark()
+        except ImportError as e:
+            print(f"Skipping {name}: {e}")
+            results[name] = {"skipped": str(e)}
+    return {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec='seconds'),
+        "machine": machine_info(),
+        "settings": {"cameras": cameras, "frames": frames, "size": [width, height], "animals": animals, "seed": seed, "latency_ms": latency_ms, "detect_stride": detect_stride},
+        "results": results,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the labeling pipeline on synthetic videos with a stub detector, no recordings or model needed.")
+    parser.add_argument("-o", "--output", default=None, help="JSON report (default: benchmark_<commit>.json)")
+    parser.add_argument("--workdir", default=None, help="where the synthetic videos are kept (default: ~/.cache/semi-autolabeling/benchmark)")
+    parser.add_argument("--cameras", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=300, help="frames per synthetic video")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--animals", type=int, default=5, help="moving boxes per video")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0, help="emulated inference time per frame in ms")
+    parser.add_argument("--detect-stride", type=int, default=1)
+    parser.add_argument("--only", nargs='+', choices=['tracking', 'queue', 'render', 'export'], default=None)
+    parser.add_argument("--compare", default=None, help="report of an earlier run to compare with")
+    args = parser.parse_args()
+
+    report = run(args.workdir, args.cameras, args.frames, args.width, args.height, args.animals, args.seed, args.latency, args.detect_stride, args.only)
+    output = args.output if args.output is not None else f"benchmark_{report['commit'] or 'local'}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    print(json.dumps(report["results"], indent=1))
+    print(f"Report written to {output}")
+    if args.compare is not None:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), report)
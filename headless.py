@@ -0,0 +1,107 @@
+import os
+import glob
+import argparse
+from multiprocessing import Value
+
+from utils.tracking import track_session, evaluate_stride, tracker_params, parse_imgsz, imgsz_setting, interval_setting
+from utils.track_store import TrackReader, track_key, track_file, find_tracks, store_folders, writable_folder
+from utils.overlay import OverlayExporter
+from utils.backends import prepare_model, describe_report
+from utils.roi import load_rois, roi_path, video_stem
+from utils.profiler import StageProfiler, DISABLED
+from utils.sync import parse_sync, session_sync, sync_setting
+
+def find_videos(folder):
+    return sorted(glob.glob(f'{folder}/*.mp4')+glob.glob(f'{folder}/*.avi')+glob.glob(f'{folder}/*.mkv'))
+
+def run(folder, weight_name, output_dir=None, conf_thresh=0.2, iou_thresh=0.75, params=None, detect_stride=1, overlay=False, backend='pytorch', int8=False, imgsz=1280, profile=False, sync='index', interval=None):
+    """Runs the tracking pass on every video of a session folder without any display.
+    Boxes of every frame are stored under a key of the video, weights and parameters, in `output_dir`
+    (default: <folder>/tracks, or the user cache when the session folder is read-only), where the review
+    page picks them up instead of running the model again. Videos already stored with the same key are skipped.
+    With an onnx or openvino `backend`, a .pt model is exported first (see backends.prepare_model).
+    `imgsz`: inference size, 'auto' or per camera (see tracking.parse_imgsz).
+    The regions of interest drawn for the session (<folder>/rois.json) are used.
+    With `profile`, the time of every stage is written to profile.json / profile.csv in `output_dir`.
+    `sync`: how the frames of the cameras are matched, e.g. 'timestamps, side=0.4' (see sync.parse_sync).
+    `interval`: detect on every interval-th frame like the review page sampling them does, so that a session
+    with that interval replays the stored tracks when detect_stride > 1."""
+    videos = find_videos(folder)
+    if len(videos) == 0:
+        raise Exception(f"There is no video in {folder}")
+    folders = [output_dir] if output_dir is not None else store_folders(folder)
+    output_dir = writable_folder(folders)
+    if output_dir is None:
+        raise Exception(f"None of {folders} is writable")
+    if params is None:
+        params = tracker_params()
+    sizes = parse_imgsz(imgsz, videos)
+    if weight_name.endswith('.pt') and backend != 'pytorch':
+        weight_name, report = prepare_model(weight_name, backend, int8, videos, imgsz=sizes, conf_thresh=conf_thresh, iou_thresh=iou_thresh)
+        print(f"{backend}{' int8' if int8 else ''}: {describe_report(report)}")
+
+    rois = load_rois(roi_path(folder))
+    ## the timeline covers all the cameras of the session, even those already tracked
+    syncs = session_sync(videos, *parse_sync(sync, videos)) or [None]*len(videos)
+    keys = [track_key(video, weight_name, conf_thresh, iou_thresh, params, detect_stride=detect_stride, imgsz=imgsz_setting(size), roi=rois.get(video_stem(video)), sync=sync_setting(mapping), interval=interval_setting(interval, detect_stride)) for video, size, mapping in zip(videos, sizes, syncs)]
+    todo = []
+    for video, (key, _) in zip(videos, keys):
+        stored = find_tracks(folders, video, key)
+        if stored is not None:
+            print(f"{os.path.basename(video)}: already tracked with these inputs ({stored}).")
+        else:
+            todo.append(video)
+    if len(todo) == 0:
+        return output_dir
+
+    store_paths = [track_file(output_dir, video, keys[videos.index(video)][0]) for video in todo]
+    store_meta = [keys[videos.index(video)][1] for video in todo]
+    exporter = OverlayExporter(todo, os.path.join(output_dir, 'review'), sync=[syncs[videos.index(video)] for video in todo]) if overlay else None
+    profiler = StageProfiler(len(todo)) if profile else DISABLED
+    try:
+        track_session(todo, interval, weight_name, conf_thresh, iou_thresh, params, [dict() for _ in todo], None, Value('b', True), Value('i', 0), detect_stride=detect_stride, overlay=exporter, store_paths=store_paths, store_meta=store_meta, imgsz=[sizes[videos.index(video)] for video in todo], rois=[rois.get(video_stem(video)) for video in todo], profiler=profiler, sync=[syncs[videos.index(video)] for video in todo])
+    except KeyboardInterrupt:
+        print("Interrupted, unfinished videos are not stored.")
+    if exporter is not None:
+        exporter.close()
+    if profiler.enabled:
+        print(f"Stage timings are written to {profiler.save(output_dir, [video_stem(video) for video in todo], {'weights': weight_name, 'detect_stride': detect_stride, 'imgsz': imgsz, 'backend': backend, 'int8': int8})}")
+    for video, path in zip(todo, store_paths):
+        if os.path.isfile(path):
+            print(f"{os.path.basename(video)}: {len(TrackReader(path))} frames tracked.")
+    return output_dir
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run box tracking on a recording session without the GUI.")
+    parser.add_argument("folder", help="folder containing synchronized videos of a recording session")
+    parser.add_argument("weights", help="YOLO box model (*.pt)")
+    parser.add_argument("-o", "--output", default=None, help="where to store the tracks (default: <folder>/tracks, or ~/.cache/semi-autolabeling/tracks if it is read-only)")
+    parser.add_argument("--iou", type=float, default=0.75, help="IoU threshold used during NMS")
+    parser.add_argument("--conf", type=float, default=0.2, help="minimum box confidence")
+    parser.add_argument("--track-high-thresh", type=float, default=0.5)
+    parser.add_argument("--track-low-thresh", type=float, default=0.1)
+    parser.add_argument("--new-track-thresh", type=float, default=0.5)
+    parser.add_argument("--track-buffer", type=int, default=300)
+    parser.add_argument("--match-thresh", type=float, default=0.8)
+    parser.add_argument("--detect-stride", type=int, default=1, help="run detection on every n-th frame only, tracks are predicted in between")
+    parser.add_argument("--interval", type=int, default=None, help="with --detect-stride, also detect on every n-th frame, as the review page does with that interval, so it can replay the tracks")
+    parser.add_argument("--overlay", action='store_true', help="also write an annotated review video per camera to <output>/review")
+    parser.add_argument("--backend", choices=['pytorch', 'onnx', 'openvino'], default='pytorch', help="run an ONNX Runtime or OpenVINO export of a .pt model (exported once, faster on CPU)")
+    parser.add_argument("--imgsz", default='1280', help="inference size: 640, auto (smallest size agreeing with 1280 on the first frames) or per camera, e.g. '1280, top=640, side=auto'")
+    parser.add_argument("--int8", action='store_true', help="quantize the OpenVINO export to int8, calibrated on frames of the session")
+    parser.add_argument("--sync", default='index', help="how frames of the cameras are matched: index, timestamps (of the video files) or fps, optionally with offsets in seconds, e.g. 'timestamps, side=0.4'")
+    parser.add_argument("--profile", action='store_true', help="write the time of every stage (decode, inference, tracking) to profile.json / profile.csv in the output folder")
+    parser.add_argument("--evaluate-strides", type=int, nargs='+', default=None, help="only report the ID consistency of these strides against per-frame detection")
+    parser.add_argument("--eval-frames", type=int, default=3000, help="number of frames per video used by --evaluate-strides")
+    args = parser.parse_args()
+
+    params = tracker_params(args.track_high_thresh, args.track_low_thresh, args.new_track_thresh, args.track_buffer, args.match_thresh)
+    if args.evaluate_strides is not None:
+        videos = find_videos(args.folder)
+        report = evaluate_stride(videos, args.weights, args.conf, args.iou, params, args.evaluate_strides, args.eval_frames, parse_imgsz(args.imgsz, videos))
+        for stride, metrics in report.items():
+            for video, m in zip(videos, metrics):
+                print(f"stride {stride:4d} | {os.path.basename(video)}: recall {m['recall']:.3f}, consistency {m['consistency']:.3f}, {m['id_switches']} id switches ({m['reference_boxes']} reference boxes)")
+    else:
+        output = run(args.folder, args.weights, args.output, args.conf, args.iou, params, args.detect_stride, args.overlay, args.backend, args.int8, args.imgsz, args.profile, args.sync, args.interval)
+        print(f"Tracks are written to {output}")
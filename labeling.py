@@ -1,69 +1,3 @@
-def track(video_name, interval, weight_name, conf_thresh, iou_thresh, mapping, output_stream, running, video_length):
-    from collections import defaultdict
-
-    model = YOLO(weight_name)
-    cap = cv2.VideoCapture(video_name)
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    # Store the track history
-    track_history = defaultdict(lambda: [])
-
-    video_length.value = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    cnt = -1
-    while cap.isOpened() and running.value:
-        success, frame = cap.read()
-        if not success:
-            break
-        cnt+=1
-
-        # Run tracking on the frame
-        results_ = model.track(
-            frame,
-            persist=True,
-            tracker="parameters.yaml",
-            imgsz=1280,
-            conf=conf_thresh,
-            iou=iou_thresh,
-            half=False,
-            device=device,
-            save=False,
-            verbose=False,
-            show=False,
-            stream=True
-        )
-
-        for results in results_:
-            results = results.to('cpu')
-
-            # Get boxes and track IDs
-            num_boxes = results.boxes.data.shape[0]
-            boxes = []
-            track_ids = []
-            if num_boxes > 0 and results.boxes.id is not None:
-                boxes = results.boxes.xywh.cpu().tolist()
-                track_ids = results.boxes.id.int().cpu().tolist()
-
-                annotated_frame = results.plot()
-
-                for box, track_id in zip(boxes, track_ids):
-                    x, y, w, h = box
-                    track = track_history[track_id]
-                    track.append((float(x), float(y)))  # x, y center point
-                    if len(track) > 90:
-                        track.pop(0)
-
-                    # Draw track line
-                    points = np.hstack(track).astype(np.int32).reshape((-1, 1, 2))
-                    cv2.polylines(annotated_frame, [points], isClosed=False, color=(0, 255, 0), thickness=10)
-
-            for id in track_ids:
-                if id not in mapping:
-                    mapping[id] = 0
-
-        if cnt%interval==0:
-            output_stream.put((cv2.cvtColor(frame,cv2.COLOR_BGR2RGB), boxes, track_ids, cnt))
-
-    output_stream.put(None)
-
 class App:
     __release_version = "1.0.1.250810"
 
@@ -86,6 +20,21 @@ class App:
         self.video_files_count_lbl = Label(2*offset_x, 2*offset_y+2*y, w=w/3-2*offset_x)
         self.browse_output_btn = Button("Browse Output Folder", w/3-2*(offset_x), y, (w-w/3, offset_y+y), func=self.__browse_output)
         self.output_dir_lbl = Label(w-w/3, offset_y+2*y, w=w/3-2*offset_x)
+        self.suggest_names_ckb = Checkbox(screen, w-w/3, 2*offset_y+2*y, caption="Suggest names of new ids")
+        self.suggest_names_hint_tk = Toolkit(screen, w-w/3+self.suggest_names_ckb.rect.width+10, 2*offset_y+2*y, text="Pre-fill new track ids with the name of the most similar labeled crops, with a similarity score. Every Confirm adds the labeled crops to a gallery stored in the output folder (gallery.npz), so later sessions start with it. Suggestions are labels like any other: correct them before confirming.")
+        self.tracker_workers_lbl = Label(w-w/3, 2*offset_y+3*y+h/100, text='Tracker Workers:')
+        self.tracker_workers_inp = InputBox(w-w/3+w/10, 2*offset_y+3*y+h/100, w/12, y, text='1')
+        self.tracker_workers_hint_tk = Toolkit(screen, w-w/3+w/10+w/12+10, 2*offset_y+3*y+h/100, text="Number of processes the cameras to track are split among, each running its own model on its own share of the CPU cores (one core is kept for this window). More workers help on CPU when a single process can't use all the cores. The frames per second of each camera are shown on the review page. The annotated review video needs a single worker.")
+        self.profile_ckb = Checkbox(screen, 4*w/6+offset_x, 6*h/10+3*offset_y+2*y+h/20, caption="Profile pipeline stages")
+        self.profile_hint_tk = Toolkit(screen, 4*w/6+offset_x+self.profile_ckb.rect.width+10, 6*h/10+3*offset_y+2*y+h/20, text="Time every stage (decode, inference, tracking, queue waits, rendering, Confirm, crop writes) per camera. The review page shows the timings (F2 hides them) and they are written to profile.json and profile.csv in the dataset folder when the session ends. Costs close to nothing.")
+        self.resume_btn = Button("Resume Session", w/6, y, (w/2-w/12, offset_y+y), func=self.__browse_checkpoint)
+        self.resume_hint_tk = Toolkit(screen, w/2+w/12+10, offset_y+y, text="Select the checkpoint.json of an interrupted session (saved in its dataset folder at every Confirm). Videos, model, parameters, options, names and assigned ids are restored and processing continues after the last confirmed frame. Only open checkpoints you wrote: the tracker states in them are unpickled.")
+        self.resume_lbl = Label(w/2-w/12, offset_y+2*y, w=w/6)
+        self.backend_lst = DropDown(w/2-w/12, 2*offset_y+2*y, w/6, y, options=list(BACKEND_OPTIONS.keys()))
+        self.imgsz_lbl = Label(w/3, 2*offset_y+3*y+h/100, text='Inference Size:')
+        self.imgsz_inp = InputBox(w/2-w/12, 2*offset_y+3*y+h/100, w/6, y, text='1280')
+        self.imgsz_hint_tk = Toolkit(screen, w/2+w/12+10, 2*offset_y+3*y+h/100, text="Image size the box model runs at. One value for all cameras (e.g. 640), 'auto' to pick per camera the smallest of 640 / 960 / 1280 whose boxes on the first 30 frames agree with 1280, or per camera by video name, e.g. '1280, top=640, side=auto'.")
+        self.backend_hint_tk = Toolkit(screen, w/2+w/12+10, 2*offset_y+2*y, text="Inference runtime of a .pt box model. ONNX Runtime and OpenVINO are usually much faster on CPU; OpenVINO int8 is quantized on frames of the session. The model is exported once (to an 'exported' folder beside it) and compared with the .pt on frames of the session; the result is shown on the review page. Exported models (.onnx, OpenVINO .xml) can also be loaded directly.")
         #### ---- box parameteres
         self.box_param_title_lbl = Label(offset_x, 2*h/10+y, text="Box Prediction Parameters")
         self.load_box_model_btn = Button("Load Box Model", w/6-offset_x, y, (offset_x, 2*h/10+2*offset_y+y), func=self.__load_box_model)
@@ -96,6 +45,12 @@ class App:
         self.conf_inp = InputBox(2*w/5+offset_x, 2*h/10+2*offset_y+y, w/6-offset_x, y, text='0.2')
         self.conf_lbl = Label(2*w/5+offset_x, 2*h/10+offset_y+y, text='Box Confidence:')
         self.conf_hint_tk = Toolkit(screen, self.conf_lbl.x+self.conf_lbl.get_width()+10, 2*h/10+offset_y+y, text="Sets minimum confidence threshold for box detections. Higher value leads to fewer but more accurate boxes. Lower value capture more objects, including less accurate ones.")
+        self.detect_stride_inp = InputBox(3*w/5+offset_x, 2*h/10+2*offset_y+y, w/6-offset_x, y, text='1')
+        self.detect_stride_lbl = Label(3*w/5+offset_x, 2*h/10+offset_y+y, text='Detection Stride:')
+        self.detect_stride_hint_tk = Toolkit(screen, self.detect_stride_lbl.x+self.detect_stride_lbl.get_width()+10, 2*h/10+offset_y+y, text="Run box detection only on every n-th frame (and always on the frames shown for labeling). Tracks are carried forward by motion prediction in between. 1 detects on every frame. Use headless.py --evaluate-strides to see what a stride costs in ID consistency.")
+        self.track_export_rate_inp = InputBox(4*w/5+offset_x, 2*h/10+2*offset_y+y, w/6-offset_x, y, text='0')
+        self.track_export_rate_lbl = Label(4*w/5+offset_x, 2*h/10+offset_y+y, text='Track Export Rate:')
+        self.track_export_rate_hint_tk = Toolkit(screen, self.track_export_rate_lbl.x+self.track_export_rate_lbl.get_width()+10, 2*h/10+offset_y+y, text="On Confirm, also export the crops of a labeled track in the frames since the previous sampled frame, using the boxes already computed by the tracker. n exports every n-th frame, 0 exports only the sampled frame.")
         #### ---- tracking parameters
         self.track_param_title_lbl = Label(offset_x, 4*h/10+y, text="Tracking Parameteres")
         self.track_high_thresh_inp = InputBox(offset_x, 4*h/10+2*offset_y+y,  w/7-offset_x, y, text='0.5')
@@ -122,11 +77,45 @@ class App:
         self.monkey_name_inp = InputBox(offset_x, 6*h/10+2*offset_y+y, w/6-offset_x, y, func=self.__enable_btn)
         self.add_monkey_name_btn = Button("Add Name", w/6-offset_x, y, (offset_x,6*h/10+3*offset_y+2*y), clickable=False, func=self.__add_monkey)
         self.add_monkey_name_hint_lbl = Label(offset_x,6*h/10+3*offset_y+3*y, color=(250,50,100))
+        #### ---- crop export
+        self.crop_export_title_lbl = Label(5*w/12, 6*h/10+y, text="Crop Export")
+        self.crop_export_hint_tk = Toolkit(screen, 5*w/12+self.crop_export_title_lbl.get_width()+10, 6*h/10+y, text="Image format of the labeled crops, quality (jpg / webp, 0-100), crop size (e.g. 128 or 128x96, 0 keeps the box size) and container: loose files per name, tar shards with an index, or a single HDF5 file (only offered when h5py is installed).")
+        self.crop_format_lbl = Label(5*w/12, 6*h/10+offset_y+y, text='Format:')
+        self.crop_format_lst = DropDown(5*w/12, 6*h/10+2*offset_y+y, w/9, y, options=['png', 'jpg', 'webp'])
+        self.crop_quality_lbl = Label(5*w/12+w/8, 6*h/10+offset_y+y, text='Quality:')
+        self.crop_quality_inp = InputBox(5*w/12+w/8, 6*h/10+2*offset_y+y, w/9, y, text='95')
+        self.crop_container_lbl = Label(5*w/12, 6*h/10+3*offset_y+2*y, text='Container:')
+        self.crop_container_lst = DropDown(5*w/12, 6*h/10+4*offset_y+2*y, w/9, y, options=available_containers())
+        self.crop_size_lbl = Label(5*w/12+w/8, 6*h/10+3*offset_y+2*y, text='Crop Size:')
+        self.crop_size_inp = InputBox(5*w/12+w/8, 6*h/10+4*offset_y+2*y, w/9, y, text='0')
+        #### ---- frame buffering
+        self.buffering_title_lbl = Label(4*w/6+offset_x, 6*h/10+y, text="Frame Buffering")
+        self.prefetch_depth_inp = InputBox(4*w/6+offset_x, 6*h/10+2*offset_y+y, w/7-offset_x, y, text='8')
+        self.prefetch_depth_lbl = Label(4*w/6+offset_x, 6*h/10+offset_y+y, text='Prefetch Depth:')
+        self.prefetch_depth_hint_tk = Toolkit(screen, self.prefetch_depth_lbl.x+self.prefetch_depth_lbl.get_width()+10, 6*h/10+offset_y+y, text="Lookahead: number of sampled frames each camera prepares ahead of the one on display, while you label. Confirm shows the next prepared frames at once and never waits; a camera that isn't ready yet shows up as soon as it is. Tracking pauses when a camera's queue is full.")
+        self.memory_budget_inp = InputBox(5*w/6+offset_x, 6*h/10+2*offset_y+y, w/7-offset_x, y, text='4096')
+        self.memory_budget_lbl = Label(5*w/6+offset_x, 6*h/10+offset_y+y, text='Memory Budget (MB):')
+        self.export_overlay_ckb = Checkbox(screen, 4*w/6+offset_x, 6*h/10+3*offset_y+2*y, caption="Export annotated review video")
+        self.export_overlay_hint_tk = Toolkit(screen, 4*w/6+offset_x+self.export_overlay_ckb.rect.width+10, 6*h/10+3*offset_y+2*y, text="Write a video per camera with boxes, ids, assigned names and trails to <output>/review. It is decoded and encoded in its own process from the boxes of the trackers, which keep skipping frames between detections. Names show up from the moment they are assigned. Cameras replayed from precomputed tracks are not exported.")
+        self.memory_budget_hint_tk = Toolkit(screen, self.memory_budget_lbl.x+self.memory_budget_lbl.get_width()+10, 6*h/10+offset_y+y, text="Maximum memory used by the frames waiting for review, all cameras together. Tracking pauses when it is reached. Every camera can still hold at least one frame.")
+        #### ---- camera synchronization
+        self.sync_lbl = Label(w/5+offset_x, h-y-offset_y+h/100, text='Camera Sync:')
+        self.sync_inp = InputBox(w/5+offset_x+w/12, h-y-offset_y, w/5, y, text='index')
+        self.sync_hint_tk = Toolkit(screen, w/5+offset_x+w/12+w/5+10, h-y-offset_y, text="How frames of the cameras are matched. 'index': frame N of every camera belongs together. 'timestamps': by the time stamps of the video files, which handles dropped frames and different frame rates. 'fps': by frame number over the frame rate. Offsets in seconds can follow, for all cameras or by video name, e.g. 'timestamps, side=0.4' when the side camera started 0.4 s before the others. Frames a camera skips are not decoded.")
         #### --------
         self.process_btn = Button("Process", w/6-offset_x, y, (w-w/6-2*offset_x, h-y-offset_y), clickable=False, func=self.__wait_for_process, process=self.__process)
+        self.roi_btn = Button("Draw ROIs", w/6-offset_x, y, (w-2*w/6-3*offset_x, h-y-offset_y), clickable=False, func=self.__open_rois)
+        self.roi_hint_tk = Toolkit(screen, w-2*w/6-3*offset_x-self.w//50-10, h-y-offset_y, text="Draw the region of each camera where animals can be. The model only looks at that crop of the frames, which is faster in proportion to the area left out. Regions are saved in rois.json in the video folder and used by headless.py too.")
+        #### ---- region of interest page
+        self.roi_info_lbl = Label(0, .05*h/2, w = w, pos='center')
+        self.roi_prev_btn = Button("Previous", w/12-offset_x, y, (offset_x, h-y-offset_y), func=self.__roi_camera, step=-1)
+        self.roi_next_btn = Button("Next", w/12-offset_x, y, (w/12+offset_x, h-y-offset_y), func=self.__roi_camera, step=1)
+        self.roi_clear_btn = Button("Clear", w/12-offset_x, y, (w/2-w/24, h-y-offset_y), func=self.__roi_clear)
+        self.roi_done_btn = Button("Done", w/12-offset_x, y, (w-w/12-2*offset_x, h-y-offset_y), func=self.__roi_done)
 
         self.monkey_list_lst = DropDown(offset_x, offset_y, w/6-offset_x, y, options=["No Label"], enable=False, scrollable=True, height=8*h/10, func=self.__select_monkey)
         self.progress_info_lbl = Label(0, .05*h/2, w = w, pos='center')
+        self.buffer_info_lbl = Label(0, h-y-offset_y, w = w, pos='center', color=(100,100,100))
         self.confirm_btn = Button("Confirm", w/12-offset_x, y, (w-w/12-2*offset_x, h-y-offset_y), func=self.__confirm)
         self.finish_btn = Button("Terminate", w/12-offset_x, y, (offset_x, h-y-offset_y), func=self.__finish)
 
@@ -156,7 +145,7 @@ class App:
             self.prediction_device_lbl.text = "CUDA is available. Prediction will be done on GPU."
             self.prediction_device_lbl.color = (50,200,10)
         else:
-            self.prediction_device_lbl.text = "CUDA isn't available! Prediction will be done on CPU."
+            self.prediction_device_lbl.text = "CUDA isn't available! Prediction will be done on CPU, an ONNX Runtime or OpenVINO backend is faster there."
             self.prediction_device_lbl.color = (200,10,50)
 
         ### waiting page ------
@@ -165,19 +154,67 @@ class App:
         ## --------------------
 
         self.input_video = ''
+        self.video_folder = ''
         self.output_dir = ''
         self.box_weight = None
         self.monkey_list = []
 
+        self.resume = None
+        self.crop_writer = None
+        self.track_exporter = None
+        self.checkpoint_writer = None
+        self.pending = set()
+        self.suggester = None
+        self.model_report = None
+        self.rois = {}
+        self.profiler = DISABLED
+        self.show_profile = False
+        self.roi_btn.update_text("Draw ROIs")
         self.done = False
 
     def __quit(self):
         try:
+            ## producers blocked on a full queue give up once running is cleared. A process only exits once the
+            ## feeder threads of its queues are flushed, so the rings are drained while waiting for it; one that
+            ## still doesn't stop is terminated
             self.tracking_running.value = False
-            for i in range(len(self.tracking_on_video_process)):
-                while self.tracked_videos[i].qsize()>0:
-                    _ = self.tracked_videos[i].get()
-                self.tracking_on_video_process[i].join()
+            deadline = time.time()+10
+            for process in self.tracking_on_video_process:
+                while process.is_alive() and time.time() < deadline:
+                    for ring in self.tracked_videos:
+                        ring.drain()
+                    process.join(.1)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            if self.overlay is not None:
+                self.overlay.close()
+                self.overlay = None
+            if self.suggester is not None:
+                self.suggester.close()
+                self.suggester = None
+            if self.track_exporter is not None:
+                self.track_exporter.close()
+                self.track_exporter = None
+            if self.crop_writer is not None:
+                self.crop_writer.close()
+                self.crop_writer = None
+            if self.checkpoint_writer is not None:
+                self.checkpoint_writer.close()
+                self.checkpoint_writer = None
+            if self.profiler.enabled:
+                print(f"Stage timings are written to {self.profiler.save(self.output_dir, [video_stem(video) for video in self.input_video], self.session)}")
+                self.profiler = DISABLED
+            ## drop the views on shared memory before closing it
+            self.pending = set()
+            self.frame_grid = []
+            self.cover_grid = []
+            self.tiles = []
+            for i in range(len(self.tracked_videos)):
+                self.tracked_videos[i].drain()
+                self.tracked_videos[i].close()
+                self.frame_budget.release(self.tracked_videos[i].nbytes)
+            self.tracked_videos = []
         except:
             pass
 
@@ -223,19 +260,59 @@ class App:
         self.back_to_menu_btn.clickable = True
 
     def __browse_output(self):
+        self.resume = None
+        self.resume_lbl.text = ""
         try:
             self.output_dir = self.__prompt_file(mode='folder')
             self.output_dir_lbl.text = self.output_dir
         except:
             self.output_dir_lbl.text = ""
 
+    def __browse_checkpoint(self):
+        try:
+            checkpoint = load_checkpoint(self.__prompt_file(filetype=("Session checkpoint", "*.json")))
+        except Exception as e:
+            print(e)
+            return
+        self.input_video = checkpoint["videos"]
+        self.video_folder = checkpoint["video_folder"]
+        self.video_file_lbl.text = self.video_folder
+        self.video_files_count_lbl.text = f"{len(self.input_video)} video(s) found."
+        self.box_weight = checkpoint["weights"]
+        self.rois = valid_rois(checkpoint.get("rois", {}))
+        self.roi_btn.update_text(f"Draw ROIs ({len(self.rois)})" if len(self.rois) > 0 else "Draw ROIs")
+        self.load_box_model_lbl.text = self.box_weight
+        self.output_dir = checkpoint["output_dir"]
+        self.output_dir_lbl.text = self.output_dir
+        self.monkey_list = checkpoint["monkey_list"]
+        for var, text in checkpoint["inputs"].items():
+            getattr(self, var).text = text
+        ## crop format and container, backend, ... and the checkboxes; older checkpoints only have the backend
+        for var, option in checkpoint.get("choices", {"backend_lst": checkpoint.get("backend", "PyTorch")}).items():
+            if hasattr(self, var) and option in getattr(self, var).options:
+                getattr(self, var).set_active_option(getattr(self, var).options.index(option))
+        for var, checked in checkpoint.get("checks", {}).items():
+            if hasattr(self, var):
+                getattr(self, var).checked = checked
+        self.resume = checkpoint
+        self.resume_lbl.text = f"Resuming after frame {min(checkpoint['confirmed'])+1}."
+
     def __browse_videos(self):
+        self.resume = None
+        self.resume_lbl.text = ""
         try:
             folder = self.__prompt_file(mode="folder")
             self.input_video = glob.glob(f'{folder}/*.mp4')+glob.glob(f'{folder}/*.avi')+glob.glob(f'{folder}/*.mkv')
             self.video_file_lbl.text = folder
+            self.video_folder = folder
+            self.rois = load_rois(roi_path(folder))
+            self.roi_btn.update_text(f"Draw ROIs ({len(self.rois)})" if len(self.rois) > 0 else "Draw ROIs")
             if len(self.input_video) > 0:
                 self.video_files_count_lbl.text = f"{len(self.input_video)} video(s) found."
+                ## stored tracks are reused when the weights and parameters match
+                stored = len([video for video in self.input_video if any([len(stored_tracks(f, video)) > 0 for f in store_folders(folder)])])
+                if stored > 0:
+                    self.video_files_count_lbl.text += f" Stored tracks found for {stored} video(s)."
                 self.video_files_count_lbl.color = (50,20,150)
             else:
                 self.video_files_count_lbl.text = f"There is no video in the selected path!"
@@ -245,10 +322,47 @@ class App:
             self.video_file_lbl.text = ""
             self.input_video = []
 
+    def __open_rois(self):
+        """Region of interest page: the first frame of each camera, one after the other"""
+        self.roi_frames = []
+        for video in self.input_video:
+            cap = cv2.VideoCapture(video)
+            success, frame = cap.read()
+            cap.release()
+            self.roi_frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) if success else np.zeros(frame_shape(video), dtype=np.uint8))
+        self.roi_tile = FrameTile()
+        self.roi_camera = 0
+        self.step = 2
+
+    def __roi_camera(self, step):
+        self.roi_camera = (self.roi_camera+step)%len(self.input_video)
+
+    def __roi_clear(self):
+        self.rois.pop(video_stem(self.input_video[self.roi_camera]), None)
+
+    def __roi_done(self):
+        ## a region needs two corners of a rectangle or three points of a polygon, with some area
+        self.rois = valid_rois(self.rois)
+        try:
+            save_rois(roi_path(self.video_folder), self.rois)
+        except OSError as e:
+            print(f"Couldn't save the regions in the video folder, they are only kept with the session: {e}")
+        self.roi_btn.update_text(f"Draw ROIs ({len(self.rois)})" if len(self.rois) > 0 else "Draw ROIs")
+        self.roi_frames = []
+        self.step = 0
+
+    def __roi_rect(self):
+        """Where the frame of the ROI page is drawn (x, y, w, h), keeping its aspect ratio"""
+        frame = self.roi_frames[self.roi_camera]
+        scale = min(.9*self.w/frame.shape[1], (.85*self.h)/frame.shape[0])
+        w, h = frame.shape[1]*scale, frame.shape[0]*scale
+        return (self.w-w)/2, .06*self.h, w, h
+
     def __load_box_model(self):
         try:
-            file = self.__prompt_file(filetype=("PyTorch models", "*.pt"))
-            self.box_weight = file
+            file = self.__prompt_file(filetype=("Box models", "*.pt *.onnx *.xml"))
+            ## an OpenVINO model is the folder of its .xml
+            self.box_weight = os.path.dirname(file) if file.endswith('.xml') else file
             self.load_box_model_lbl.text = file
         except:
             self.box_weight = None
@@ -270,18 +384,8 @@ class App:
     def __process(self):
         self.step += 1
 
-        ## dump tracking parameters -------------
-        params = {
-            "tracker_type": 'bytetrack',
-            "track_high_thresh": float(self.track_high_thresh_inp.text),
-            "track_low_thresh": float(self.track_low_thresh_inp.text),
-            "new_track_thresh": float(self.track_new_thresh_inp.text),
-            "track_buffer": int(self.track_buffer_inp.text),
-            "match_thresh": float(self.track_match_thresh_inp.text),
-            "fuse_score": True
-        }
-        with open("parameters.yaml", "w", encoding="utf-8") as f:
-            yaml.dump(params, f, sort_keys=False)
+        ## tracking parameters -------------
+        params = tracker_params(self.track_high_thresh_inp.text, self.track_low_thresh_inp.text, self.track_new_thresh_inp.text, self.track_buffer_inp.text, self.track_match_thresh_inp.text)
         ## --------------------------------------
 
         self.monkey_list_lst.update_options(['No Label']+self.monkey_list)
@@ -289,25 +393,147 @@ class App:
         self.frame_grid = []
         self.cover_grid = []
         self.color_coded = generate_unique_colors(len(self.monkey_list)+1)
-        self.mapping_ids = [dict()]*len(self.input_video)
+        self.mapping_ids = [dict() for _ in self.input_video] if self.resume is None else self.resume["mappings"]
+        self.suggestions = [dict() for _ in self.input_video]
+        self.suggested = 0
+        self.tiles = [FrameTile() for _ in self.input_video]
+        self.render_ms = 0
+        start_frames = [0]*len(self.input_video) if self.resume is None else [cnt+1 for cnt in self.resume["confirmed"]]
+        tracker_states = [None]*len(self.input_video) if self.resume is None else self.resume["tracker_states"]
+        self.session = {
+            "videos": self.input_video,
+            "video_folder": self.video_folder,
+            "weights": self.box_weight,
+            "backend": self.backend_lst.get_active_option(),
+            "rois": self.rois,
+            "monkey_list": self.monkey_list,
+            "inputs": {var: getattr(self, var).text for var in vars(self) if var.endswith('_inp') and var != 'monkey_name_inp'},
+            "choices": {var: getattr(self, var).get_active_option() for var in vars(self) if var.endswith('_lst') and var != 'monkey_list_lst'},
+            "checks": {var: getattr(self, var).checked for var in vars(self) if var.endswith('_ckb')},
+        }
         self.tracking_running = Value('b', True)
+        self.frame_budget = MemoryBudget(int(float(self.memory_budget_inp.text)*1024**2))
         self.tracking_on_video_process = []
         self.whole_video_length = Value('i', 0)
+        self.camera_fps = [Value('d', 0) for _ in self.input_video]
+        self.profiler = StageProfiler(len(self.input_video)) if self.profile_ckb.checked else DISABLED
+        self.show_profile = self.profiler.enabled
+        if self.resume is None:
+            self.output_dir = os.path.join(self.output_dir,'dataset_'+datetime.now().strftime("%Y%m%d%H%M%S"))
+        ## the gallery is shared by the sessions of the chosen output folder
+        if self.suggest_names_ckb.checked and self.box_weight.endswith('.pt'):
+            self.suggester = NameSuggester(self.box_weight, os.path.dirname(self.output_dir))
+        ## tracks stored by an earlier session or headless.py with the same inputs are replayed
+        folders = store_folders(self.video_folder)
+        ## exported backends run their own model file, the .pt is kept for the name suggestions
+        self.model_path, self.model_report = self.box_weight, None
+        sizes = parse_imgsz(self.imgsz_inp.text, self.input_video)
+        backend, int8 = BACKEND_OPTIONS[self.backend_lst.get_active_option()]
+        if self.box_weight.endswith('.pt') and backend != 'pytorch':
+            try:
+                self.model_path, self.model_report = prepare_model(self.box_weight, backend, int8, self.input_video, imgsz=sizes, conf_thresh=float(self.conf_inp.text), iou_thresh=float(self.iou_inp.text))
+            except Exception as e:
+                print(f"Couldn't use {backend}, running the .pt model: {e}")
+                self.model_report = {"error": str(e)}
+        ## frame i of every camera on one timeline, None keeps the frame index
+        self.sync = session_sync(self.input_video, *parse_sync(self.sync_inp.text, self.input_video))
+        syncs = self.sync if self.sync is not None else [None]*len(self.input_video)
+        keys = [track_key(video, self.model_path, self.conf_inp.text, self.iou_inp.text, params, detect_stride=max(1, int(self.detect_stride_inp.text)), imgsz=imgsz_setting(size), roi=self.rois.get(video_stem(video)), sync=sync_setting(sync), interval=interval_setting(int(self.frame_interval_inp.text), max(1, int(self.detect_stride_inp.text)))) for video, size, sync in zip(self.input_video, sizes, syncs)]
+        precomputed_tracks = [find_tracks(folders, video, key[0]) for video, key in zip(self.input_video, keys)]
+        store_folder = writable_folder(folders)
+        to_track = []
         for i,video in enumerate(self.input_video):
-            self.tracked_videos.append(Queue())
-            self.tracking_on_video_process.append(threading.Thread(target = track, args=(video, int(self.frame_interval_inp.text), self.box_weight, float(self.conf_inp.text), float(self.iou_inp.text), self.mapping_ids[i], self.tracked_videos[-1], self.tracking_running, self.whole_video_length)))
+            ## frames are handed over in shared memory, the prefetch depth is cut down to fit the budget
+            shape = frame_shape(video)
+            depth = min(int(self.prefetch_depth_inp.text), self.frame_budget.limit//(len(self.input_video)*int(np.prod(shape)))-1)
+            self.tracked_videos.append(SharedFrameRing(shape, max(1, depth)))
+            self.frame_budget.add(self.tracked_videos[-1].nbytes)
+            if precomputed_tracks[i] is not None:
+                self.tracking_on_video_process.append(Process(target = replay, args=(video, int(self.frame_interval_inp.text), precomputed_tracks[i], self.mapping_ids[i], self.tracked_videos[-1], self.tracking_running, self.whole_video_length), kwargs={'start_frame': start_frames[i], 'fps': self.camera_fps[i], 'profiler': self.profiler, 'camera': i, 'sync': syncs[i]}))
+                self.tracking_on_video_process[-1].start()
+            else:
+                to_track.append(i)
+        ## the cameras that still need tracking are split among the tracker workers, one model each, on their
+        ## own cores; the first core is left to this window
+        self.overlay = None
+        self.overlay_cameras = to_track
+        workers = 1 if self.export_overlay_ckb.checked else max(1, min(int(self.tracker_workers_inp.text), len(to_track)))
+        groups = [to_track[g::workers] for g in range(workers)] if len(to_track) > 0 else []
+        cores = partition_cores(len(groups), reserve=1)
+        for group, group_cores in zip(groups, cores):
+            if self.export_overlay_ckb.checked:
+                self.overlay = OverlayExporter([self.input_video[i] for i in group], os.path.join(self.output_dir, 'review'), sync=[syncs[i] for i in group])
+            options = {
+                'detect_stride': max(1, int(self.detect_stride_inp.text)),
+                'overlay': self.overlay,
+                'store_paths': [track_file(store_folder, self.input_video[i], keys[i][0]) if store_folder is not None else None for i in group],
+                'store_meta': [keys[i][1] for i in group],
+                'start_frame': min([start_frames[i] for i in group]),
+                'tracker_states': [tracker_states[i] for i in group],
+                'imgsz': [sizes[i] for i in group],
+                'rois': [self.rois.get(video_stem(self.input_video[i])) for i in group],
+                'cores': group_cores,
+                'fps': [self.camera_fps[i] for i in group],
+                'profiler': self.profiler,
+                'camera_ids': group,
+                'sync': [syncs[i] for i in group],
+            }
+            self.tracking_on_video_process.append(Process(target = track_session, args=([self.input_video[i] for i in group], int(self.frame_interval_inp.text), self.model_path, float(self.conf_inp.text), float(self.iou_inp.text), params, [self.mapping_ids[i] for i in group], [self.tracked_videos[i] for i in group], self.tracking_running, self.whole_video_length), kwargs=options))
             self.tracking_on_video_process[-1].start()
-        for i in range(len(self.tracked_videos)):
-            frame_info = self.tracked_videos[i].get()
-            self.cover_grid.append(ClickableArea(0,0,frame_info[0].shape[1],frame_info[0].shape[0],frame_info[1],{key: self.monkey_list_lst.options[value] for key, value in self.mapping_ids[i].items()}, frame_info[2], {key: self.color_coded[value] for key, value in self.mapping_ids[i].items()}, func=self.__click_on_monkey_box, area_num=i))
-            self.frame_grid.append(frame_info)
-            self.progress_info_lbl.text = f"Tracking frame {frame_info[-1]+1} / {self.whole_video_length.value}."
+        ## the review page opens right away, frames show up as the trackers send them (see __poll_frames)
+        self.frame_grid = [None]*len(self.tracked_videos)
+        self.cover_grid = [None]*len(self.tracked_videos)
+        self.pending = set(range(len(self.tracked_videos)))
+        self.pending_since = self.profiler.start()
+        self.checkpoint_writer = CheckpointWriter()
 
         # os.makedirs(os.path.join(self.output_dir,'dataset'),exist_ok=True)
-        self.output_dir = os.path.join(self.output_dir,'dataset_'+datetime.now().strftime("%Y%m%d%H%M%S"))
-        for monkey in self.monkey_list:
-            os.makedirs(os.path.join(self.output_dir,monkey),exist_ok=True)
-
+        container = self.crop_container_lst.get_active_option()
+        if container == 'files':
+            for monkey in self.monkey_list:
+                os.makedirs(os.path.join(self.output_dir,monkey),exist_ok=True)
+        size = [int(s) for s in self.crop_size_inp.text.lower().split('x')]
+        self.crop_writer = CropWriter(self.output_dir, fmt=self.crop_format_lst.get_active_option(), quality=int(self.crop_quality_inp.text), size=(size[0], size[-1]) if size[0] > 0 else None, container=container, profiler=self.profiler)
+        if int(self.track_export_rate_inp.text) > 0:
+            self.track_exporter = TrackExporter(self.input_video, self.crop_writer, rate=int(self.track_export_rate_inp.text), sync=self.sync)
+
+
+    def __next_frame(self, i, block=True):
+        """Next sampled frame of camera i (queue.Empty when it isn't there and not `block`).
+        Its track ids are registered here since the trackers run in other processes"""
+        frame_info = self.tracked_videos[i].get(block=block)
+        if frame_info is not None:
+            new = [j for j, id in enumerate(frame_info[2]) if id not in self.mapping_ids[i]]
+            for j in new:
+                self.mapping_ids[i][frame_info[2][j]] = 0
+            if self.suggester is not None and len(new) > 0:
+                self.suggester.suggest(i, frame_info[0], [frame_info[2][j] for j in new], [frame_info[1][j] for j in new], allowed=self.monkey_list)
+        return frame_info
+
+    def __apply_suggestions(self):
+        """Assigns the names the suggester found since the last call to the ids still without a name"""
+        changed = set()
+        for i, ids, names, scores in self.suggester.poll():
+            for id, name, score in zip(ids, names, scores):
+                if self.mapping_ids[i].get(id) == 0:
+                    self.__assign(i, id, self.monkey_list.index(name)+1)
+                    self.suggestions[i][id] = score
+                    changed.add(i)
+        for i in changed:
+            if self.cover_grid[i] is not None:
+                self.cover_grid[i].mapping = self.__names(i)
+                self.cover_grid[i].colors = {key: self.color_coded[value] for key, value in self.mapping_ids[i].items()}
+                self.cover_grid[i].update()
+        self.suggested += len(changed)
+
+    def __names(self, i):
+        """Text shown on the boxes of camera i, suggested names with their score"""
+        return {key: f"{self.monkey_list_lst.options[value]} ({self.suggestions[i][key]:.2f})" if key in self.suggestions[i] else self.monkey_list_lst.options[value] for key, value in self.mapping_ids[i].items()}
+
+    def __assign(self, i, id, option):
+        self.mapping_ids[i][id] = option
+        if self.overlay is not None and i in self.overlay_cameras:
+            self.overlay.set_name(self.overlay_cameras.index(i), id, self.monkey_list_lst.options[option] if option!=0 else None, self.color_coded[option])
 
     def __click_on_monkey_box(self, item, area_num):
         self.monkey_list_lst.enable = True
@@ -317,47 +543,166 @@ class App:
 
     def __select_monkey(self, selected_option):
         self.monkey_list_lst.enable = False
-        self.mapping_ids[self.area_of_interest][self.id_of_interest] = selected_option
-        for i in range(len(self.tracked_videos)):
-            self.cover_grid[i].mapping = {key: self.monkey_list_lst.options[value] for key, value in self.mapping_ids[i].items()}
-            self.cover_grid[i].colors = {key: self.color_coded[value] for key, value in self.mapping_ids[i].items()}
-            self.cover_grid[i].update()
+        self.__assign(self.area_of_interest, self.id_of_interest, selected_option)
+        self.suggestions[self.area_of_interest].pop(self.id_of_interest, None)
+        ## only the overlay of that camera is drawn again
+        i = self.area_of_interest
+        self.cover_grid[i].mapping = self.__names(i)
+        self.cover_grid[i].colors = {key: self.color_coded[value] for key, value in self.mapping_ids[i].items()}
+        self.cover_grid[i].update()
 
     def __confirm(self):
         print("============ confirm ============ ")
-        if np.array([self.tracked_videos[i].qsize()>0 for i in range(len(self.tracked_videos))]).any(): 
-            ### save confirmed label boxes:
-            for i in range(len(self.tracked_videos)):
-                frame_info = self.frame_grid[i]
-                frame = frame_info[0]
-                for rect, id in zip(frame_info[1], frame_info[2]):
-                    if self.mapping_ids[i][id]!=0:
-                        cropped_box = frame[int(rect[1]-rect[3]/2):int(rect[1]+rect[3]/2),int(rect[0]-rect[2]/2):int(rect[0]+rect[2]/2)]
-                        cropped_box = cv2.cvtColor(cropped_box, cv2.COLOR_RGB2BGR)
-                        cv2.imwrite(os.path.join(self.output_dir, self.monkey_list_lst.options[self.mapping_ids[i][id]],str(frame_info[-1])+'_'+os.path.basename(self.input_video[i]).split('.')[0]+'.png'), cropped_box)
-
-            self.frame_grid = []
-            self.cover_grid = []
-            for i in range(len(self.tracked_videos)):
-                frame_info = self.tracked_videos[i].get()
-                if frame_info is None:
-                    self.done = True
-                    break
-                self.cover_grid.append(ClickableArea(0,0,frame_info[0].shape[1],frame_info[0].shape[0],frame_info[1],{key: self.monkey_list_lst.options[value] for key, value in self.mapping_ids[i].items()}, frame_info[2], {key: self.color_coded[value] for key, value in self.mapping_ids[i].items()}, func=self.__click_on_monkey_box, area_num=i))
-                self.frame_grid.append(frame_info)
-                self.progress_info_lbl.text = f"Tracking frame {frame_info[-1]+1} / {self.whole_video_length.value}."
+        if len(self.pending) > 0:
+            return
+        ### hand the confirmed label boxes over to the writers, none of them makes Confirm wait
+        for i in range(len(self.tracked_videos)):
+            start = self.profiler.start()
+            frame_info = self.frame_grid[i]
+            frame = frame_info[0]
+            for rect, id in zip(frame_info[1], frame_info[2]):
+                if self.mapping_ids[i][id]!=0:
+                    self.crop_writer.submit(frame, rect, self.monkey_list_lst.options[self.mapping_ids[i][id]], str(frame_info[3])+'_'+os.path.basename(self.input_video[i]).split('.')[0], block=False)
+            if self.suggester is not None:
+                labeled = [j for j, id in enumerate(frame_info[2]) if self.mapping_ids[i][id]!=0]
+                self.suggester.learn(frame, [frame_info[1][j] for j in labeled], [self.monkey_list_lst.options[self.mapping_ids[i][frame_info[2][j]]] for j in labeled])
+            if self.track_exporter is not None:
+                self.track_exporter.submit(i, frame_info[5], {id: self.monkey_list_lst.options[value] for id, value in self.mapping_ids[i].items() if value!=0})
+            self.profiler.stop('confirm', i, start)
+        start = self.profiler.start()
+        ## the checkpoint is written once the crops of this Confirm are
+        flushed = self.track_exporter.barrier() if self.track_exporter is not None else self.crop_writer.barrier()
+        self.checkpoint_writer.submit(self.output_dir, self.session, [frame_info[3] for frame_info in self.frame_grid], self.mapping_ids, [frame_info[4] for frame_info in self.frame_grid], flushed)
+        self.profiler.stop('confirm', None, start)
+
+        ## the next frames are usually prefetched already, the others show up as they arrive
+        self.frame_grid = [None]*len(self.tracked_videos)
+        self.cover_grid = [None]*len(self.tracked_videos)
+        self.pending = set(range(len(self.tracked_videos)))
+        self.pending_since = self.profiler.start()
+        self.__poll_frames()
+
+    def __poll_frames(self):
+        """Takes the next frame of the cameras the page is waiting for, if they're there; never blocks.
+        The wait since Confirm is counted as queue_get."""
+        for i in sorted(self.pending):
+            try:
+                frame_info = self.__next_frame(i, block=False)
+            except queue.Empty:
+                continue
+            self.pending.discard(i)
+            self.profiler.stop('queue_get', i, self.pending_since)
+            if frame_info is None:
+                self.done = True
+                return
+            self.cover_grid[i] = ClickableArea(0,0,frame_info[0].shape[1],frame_info[0].shape[0],frame_info[1],self.__names(i), frame_info[2], {key: self.color_coded[value] for key, value in self.mapping_ids[i].items()}, func=self.__click_on_monkey_box, area_num=i)
+            self.frame_grid[i] = frame_info
+            self.progress_info_lbl.text = f"Tracking frame {frame_info[3]+1} / {self.whole_video_length.value}."
 
     def __finish(self):
         self.__quit()
         self.done = True
 
+    def __state(self):
+        """What the page shows besides the widgets themselves; the page is drawn again when it changes"""
+        if self.step == 1 and not self.done:
+            ## the stage timings are refreshed every second
+            return (self.step, self.done, tuple(id(frame_info) for frame_info in self.frame_grid), tuple(q.qsize()>0 for q in self.tracked_videos), self.progress_info_lbl.text, self.suggested, int(time.time()) if self.show_profile else None)
+        return (self.step, self.done)
+
+    def __animating(self):
+        """Widgets that change without input: a clicked button runs its function a few loops later, the cursor
+        of an active input box blinks"""
+        return any([getattr(self, var).isClicked > 0 for var in vars(self) if var.endswith('_btn')]) \
+            or any([getattr(self, var).active for var in vars(self) if var.endswith('_inp')])
+
+    def __buffer_info(self):
+        return "Buffered frames: " + ", ".join([f"{q.qsize()}/{q.maxsize}" for q in self.tracked_videos]) + "  |  FPS: " + ", ".join([f"{fps.value:.0f}" for fps in self.camera_fps]) + f"  |  Memory: {self.frame_budget.used/1024**2:.0f} / {self.frame_budget.limit/1024**2:.0f} MB  |  Crops waiting: {self.crop_writer.pending}" + (f" (+{self.track_exporter.pending} tracks)" if self.track_exporter is not None else "") + f"  |  Render: {self.render_ms:.1f} ms" + self.__model_info()
+
+    def __draw_grid(self):
+        n = np.ceil(np.sqrt(len(self.tracked_videos)))
+        h = .9*self.h/n - (n-1)*.01*self.h
+        w = (5/4)*h
+        x = (self.w-(n*w)-((n-1)*.01*self.h))/2     
+
+        if len(self.frame_grid) == len(self.tracked_videos):
+            for i in range(len(self.tracked_videos)):
+                start = self.profiler.start()
+                tile_x, tile_y = x+(i%n)*(w+.01*self.h)+self.w//40, .05*self.h+(i//n)*(h+.01*self.h)
+                if self.frame_grid[i] is None:
+                    self.__draw_waiting(i, tile_x, tile_y, w, h)
+                    continue
+                ## the scaled frame is kept until the frame or the tile size changes
+                tile = self.tiles[i].get(self.frame_grid[i][0], (w, h))
+                screen.blit(tile, (tile_x, tile_y))
+                self.cover_grid[i].draw(screen, tile_x, tile_y, tile.get_width(), tile.get_height())
+                self.profiler.stop('render', i, start)
+
+    def __draw_waiting(self, i, x, y, w, h):
+        """Tile of a camera whose next frame isn't there yet: its last frame greyed out, or a grey box"""
+        tile = self.tiles[i].surface
+        size = tile.get_size() if tile is not None else (int(w), int(h))
+        s = pygame.Surface(size)
+        s.fill((120,120,120))
+        if tile is not None:
+            screen.blit(tile, (x, y))
+            s.set_alpha(180)
+        screen.blit(s, (x, y))
+        text = render_text(get_font(int(.018*self.w)), f"Waiting for camera {i+1} ...", (255,255,255))
+        screen.blit(text, (x+(size[0]-text.get_width())/2, y+(size[1]-text.get_height())/2))
+
+    def __draw_profile(self):
+        """Stage timings of all cameras together over the top right corner of the review page"""
+        font = get_font(int(.014*self.w))
+        lines = [f"{'stage':<11}{'count':>8}{'mean ms':>10}{'p95 ms':>10}"]+[f"{stage:<11}{count:>8}{mean:>10.2f}{p95:>10.2f}" for stage, count, mean, p95 in self.profiler.stage_totals()]
+        texts = [render_text(font, line, (255,255,255)) for line in lines]
+        width = max([text.get_width() for text in texts])+20
+        height = sum([text.get_height() for text in texts])+20
+        s = pygame.Surface((width, height))
+        s.set_alpha(200)
+        s.fill((30,30,30))
+        screen.blit(s, (self.w-width-self.w//50, .05*self.h))
+        y = .05*self.h+10
+        for text in texts:
+            screen.blit(text, (self.w-width-self.w//50+10, y))
+            y += text.get_height()
+
+    def __model_info(self):
+        if self.model_report is None:
+            return ""
+        if "error" in self.model_report:
+            return f"  |  {self.backend_lst.get_active_option()} failed, running the .pt model"
+        return f"  |  {self.backend_lst.get_active_option()}: {describe_report(self.model_report)}"
+
+    def __draw_status(self):
+        """Draws only the status line of the review page (and the buttons on it) when its text changed"""
+        text = self.__buffer_info()
+        if text == self.buffer_info_lbl.text:
+            return
+        self.buffer_info_lbl.text = text
+        rect = pygame.Rect(0, self.buffer_info_lbl.y, self.w, self.h-self.buffer_info_lbl.y)
+        screen.set_clip(rect)
+        screen.fill((255, 255, 255))
+        self.buffer_info_lbl.draw(screen)
+        self.confirm_btn.draw(screen)
+        self.finish_btn.draw(screen)
+        self.__draw_grid()  # the lower tiles reach into the status line
+        screen.set_clip(None)
+        pygame.display.update(rect)
+
     def run(self):
         done = False
+        last_state = None
 
         while not done:
             try:
-                ## get and handle events in this frame
-                self.events = pygame.event.get()
+                ## get and handle events in this frame; when nothing is going on, sleep until an input event
+                ## arrives or it's time to look at the tracker queues again
+                if self.wait or self.__animating() or self.__state() != last_state:
+                    self.events = pygame.event.get()
+                else:
+                    event = pygame.event.wait(100)
+                    self.events = ([event] if event.type != NOEVENT else []) + pygame.event.get()
                 for event in self.events:
                     if event.type == QUIT:
                         self.__quit()
@@ -368,18 +713,39 @@ class App:
                             self.__quit()
                             pygame.quit()
                             sys.exit()
-
+                        if event.key == K_F2 and self.profiler.enabled:
+                            self.show_profile = not self.show_profile
+
+                if self.step == 1 and not self.done and len(self.pending) > 0:
+                    self.__poll_frames()
+                if self.step == 1 and not self.done and self.suggester is not None:
+                    self.__apply_suggestions()
+                state = self.__state()
+                if not (self.wait or self.events or self.__animating() or state != last_state):
+                    if self.step == 1 and not self.done:
+                        self.__draw_status()
+                    continue
+                last_state = state
                 screen.fill((255, 255, 255))
 
                 if self.step == 0:  # param page
                     self.prediction_device_lbl.draw(screen)
                     self.process_btn.clickable = len(self.input_video)>0 and (self.box_weight is not None) and self.output_dir!='' and len(self.monkey_list)>0 \
                         and self.track_high_thresh_inp.text!='' and self.track_low_thresh_inp.text!='' and self.track_buffer_inp.text!='' and self.track_match_thresh_inp.text!='' and self.track_new_thresh_inp.text!='' \
-                        and self.frame_interval_inp.text!='' and self.iou_inp.text!='' and self.conf_inp.text!=''
+                        and self.frame_interval_inp.text!='' and self.iou_inp.text!='' and self.conf_inp.text!='' and self.detect_stride_inp.text!='' \
+                        and self.prefetch_depth_inp.text!='' and self.memory_budget_inp.text!='' and self.crop_quality_inp.text!='' and self.crop_size_inp.text!='' and self.track_export_rate_inp.text!='' and self.imgsz_inp.text!='' and self.tracker_workers_inp.text!=''
                     self.browse_video_btn.draw(screen)
                     self.video_file_lbl.draw(screen)
                     self.video_files_count_lbl.draw(screen)
                     self.browse_output_btn.draw(screen)
+                    self.resume_btn.draw(screen)
+                    self.resume_lbl.draw(screen)
+                    self.imgsz_lbl.draw(screen)
+                    self.imgsz_inp.draw(screen, self.events)
+                    self.tracker_workers_lbl.draw(screen)
+                    self.tracker_workers_inp.draw(screen, self.events)
+                    self.sync_lbl.draw(screen)
+                    self.sync_inp.draw(screen, self.events)
                     self.output_dir_lbl.draw(screen)
                     self.box_param_title_lbl.draw(screen)
                     self.track_param_title_lbl.draw(screen)
@@ -391,6 +757,10 @@ class App:
                     self.iou_inp.draw(screen, self.events)
                     self.conf_lbl.draw(screen)
                     self.conf_inp.draw(screen, self.events)
+                    self.detect_stride_lbl.draw(screen)
+                    self.detect_stride_inp.draw(screen, self.events)
+                    self.track_export_rate_lbl.draw(screen)
+                    self.track_export_rate_inp.draw(screen, self.events)
                     #### ---- tracking parameters
                     self.track_high_thresh_lbl.draw(screen)
                     self.track_high_thresh_inp.draw(screen, self.events)
@@ -410,48 +780,113 @@ class App:
                     self.monkey_name_inp.draw(screen, self.events)
                     self.add_monkey_name_btn.draw(screen)
                     self.add_monkey_name_hint_lbl.draw(screen)
+                    #### ---- crop export
+                    self.crop_export_title_lbl.draw(screen)
+                    self.crop_format_lbl.draw(screen)
+                    self.crop_quality_lbl.draw(screen)
+                    self.crop_quality_inp.draw(screen, self.events)
+                    self.crop_container_lbl.draw(screen)
+                    self.crop_size_lbl.draw(screen)
+                    self.crop_size_inp.draw(screen, self.events)
+                    #### ---- frame buffering
+                    self.buffering_title_lbl.draw(screen)
+                    self.prefetch_depth_lbl.draw(screen)
+                    self.prefetch_depth_inp.draw(screen, self.events)
+                    self.memory_budget_lbl.draw(screen)
+                    self.memory_budget_inp.draw(screen, self.events)
+                    self.export_overlay_ckb.render_checkbox()
+                    self.suggest_names_ckb.render_checkbox()
+                    self.profile_ckb.render_checkbox()
                     for i, name in enumerate(self.monkey_list):
                         lbl = Label(self.w/5+self.w/50+(i//5)*self.w/10, 6*self.h/10+2*self.h/25+(i%5)*self.h/30, w=self.w/20, text=name)
                         lbl.draw(screen)
                     #### ------------
                     self.process_btn.draw(screen)
+                    self.roi_btn.clickable = len(self.input_video) > 0
+                    self.roi_btn.draw(screen)
+                    ## dropdowns last, their menus open over the other widgets
+                    self.crop_container_lst.update(self.events)
+                    self.crop_container_lst.draw(screen)
+                    self.crop_format_lst.update(self.events)
+                    self.crop_format_lst.draw(screen)
+                    self.backend_lst.update(self.events)
+                    self.backend_lst.draw(screen)
 
                     self.browse_video_hint_tk.draw()
+                    self.resume_hint_tk.draw()
+                    self.backend_hint_tk.draw()
+                    self.imgsz_hint_tk.draw()
+                    self.tracker_workers_hint_tk.draw()
+                    self.roi_hint_tk.draw()
                     self.iou_hint_tk.draw()
                     self.conf_hint_tk.draw()
+                    self.detect_stride_hint_tk.draw()
+                    self.track_export_rate_hint_tk.draw()
                     self.track_high_thresh_hint_tk.draw()
                     self.track_low_thresh_hint_tk.draw()
                     self.track_new_thresh_hint_tk.draw()
                     self.track_buffer_hint_tk.draw()
                     self.track_match_thresh_hint_tk.draw()
+                    self.prefetch_depth_hint_tk.draw()
+                    self.memory_budget_hint_tk.draw()
+                    self.export_overlay_hint_tk.draw()
+                    self.crop_export_hint_tk.draw()
+                    self.suggest_names_hint_tk.draw()
+                    self.profile_hint_tk.draw()
+                    self.sync_hint_tk.draw()
+
+                elif self.step == 2:   # region of interest page
+                    name = video_stem(self.input_video[self.roi_camera])
+                    points = self.rois.setdefault(name, [])
+                    x, y, w, h = self.__roi_rect()
+                    scale = w/self.roi_frames[self.roi_camera].shape[1]
+                    for event in self.events:
+                        if event.type == MOUSEBUTTONDOWN and x <= event.pos[0] <= x+w and y <= event.pos[1] <= y+h:
+                            if event.button == 1:
+                                points.append([int((event.pos[0]-x)/scale), int((event.pos[1]-y)/scale)])
+                            elif event.button == 3 and len(points) > 0:
+                                points.pop()
+                    screen.blit(self.roi_tile.get(self.roi_frames[self.roi_camera], (w, h)), (x, y))
+                    corners = [(x+px*scale, y+py*scale) for px, py in points]
+                    if len(corners) == 2:   # two corners of a rectangle
+                        (x1, y1), (x2, y2) = corners
+                        pygame.draw.rect(screen, (250,50,100), pygame.Rect(min(x1,x2), min(y1,y2), abs(x2-x1), abs(y2-y1)), 3)
+                    elif len(corners) > 2:
+                        pygame.draw.polygon(screen, (250,50,100), corners, 3)
+                    for corner in corners:
+                        pygame.draw.circle(screen, (250,50,100), corner, 5)
+                    self.roi_info_lbl.text = f"Camera {self.roi_camera+1} / {len(self.input_video)}: {name}. Left click adds a point (two points make a rectangle, more a polygon), right click removes the last one. No point uses the whole frame."
+                    self.roi_info_lbl.draw(screen)
+                    self.roi_prev_btn.draw(screen)
+                    self.roi_next_btn.draw(screen)
+                    self.roi_clear_btn.draw(screen)
+                    self.roi_done_btn.draw(screen)
 
                 elif self.step == 1:   # process page
                     if self.done:
-                        font = pygame.font.Font(None, 108)
-                        text = font.render("Process is done!", True, (50,50,100))
+                        text = render_text(get_font(108), "Process is done!", (50,50,100))
                         r = text.get_rect()
                         screen.blit(text, ((self.w-r.width)//2, (self.h-r.height)//2-50))
                                 
                         self.back_to_menu_btn.draw(screen)
                     else:
-                        self.confirm_btn.clickable = np.array([self.tracked_videos[i].qsize()>0 for i in range(len(self.tracked_videos))]).all()
+                        render_start = time.perf_counter()
+                        self.confirm_btn.clickable = len(self.pending) == 0
                             
                         self.progress_info_lbl.draw(screen)
+                        self.buffer_info_lbl.text = self.__buffer_info()
+                        self.buffer_info_lbl.draw(screen)
                         self.monkey_list_lst.update(self.events)
                         self.monkey_list_lst.draw(screen)
                         self.confirm_btn.draw(screen)
                         self.finish_btn.draw(screen)
 
-                        n = np.ceil(np.sqrt(len(self.tracked_videos)))
-                        h = .9*self.h/n - (n-1)*.01*self.h
-                        w = (5/4)*h
-                        x = (self.w-(n*w)-((n-1)*.01*self.h))/2     
-
-                        if len(self.frame_grid) == len(self.tracked_videos):
-                            for i in range(len(self.tracked_videos)):
-                                frame = cv2.resize(self.frame_grid[i][0], (int(w),int(h)))
-                                screen.blit(pygame.image.frombuffer(frame.tobytes(), (frame.shape[1],frame.shape[0]), "RGB"), (x+(i%n)*(w+.01*self.h)+self.w//40,.05*self.h+(i//n)*(h+.01*self.h)))
-                                self.cover_grid[i].draw(screen, x+(i%n)*(w+.01*self.h)+self.w//40,.05*self.h+(i//n)*(h+.01*self.h),frame.shape[1],frame.shape[0])
+                        self.__draw_grid()
+                        if self.show_profile:
+                            self.__draw_profile()
+                        ## moving average of the time spent drawing the review page
+                        self.render_ms = .9*self.render_ms + .1*(time.perf_counter()-render_start)*1000
+                        self.profiler.add('render', None, time.perf_counter()-render_start)
 
 
                 ### transparent waiting page
@@ -460,8 +895,7 @@ class App:
                     s.set_alpha(220)                # alpha level
                     s.fill((50,50,50))           # this fills the entire surface
                     screen.blit(s, (0,0)) 
-                    font = pygame.font.Font(None, 92)
-                    text = font.render("Please Wait ...", True, (255,255,255))
+                    text = render_text(get_font(92), "Please Wait ...", (255,255,255))
                     r = text.get_rect()
                     screen.blit(text, ((self.w-r.width)//2, (self.h-r.height)//2))
                     self.__wait_for_process()
@@ -498,8 +932,21 @@ if __name__ == "__main__":
     import json
     import pandas as pd
     import threading
-    import yaml
+    import time
     from utils.helpers import *
+    from utils.tracking import track_session, replay, tracker_params, parse_imgsz, imgsz_setting, interval_setting
+    from utils.track_store import track_key, track_file, find_tracks, stored_tracks, store_folders, writable_folder
+    from utils.frame_ring import SharedFrameRing, MemoryBudget
+    from utils.video import frame_shape
+    from utils.overlay import OverlayExporter
+    from utils.checkpoint import CheckpointWriter, load_checkpoint
+    from utils.export import CropWriter, TrackExporter, available_containers
+    from utils.gallery import NameSuggester
+    from utils.backends import BACKEND_OPTIONS, prepare_model, describe_report
+    from utils.roi import load_rois, save_rois, roi_path, video_stem, valid_rois
+    from utils.cores import partition_cores
+    from utils.profiler import StageProfiler, DISABLED
+    from utils.sync import parse_sync, session_sync, sync_setting
 
     pygame.init()
     pygame.display.set_caption('Semi Auto Labeling')
@@ -0,0 +1,79 @@
+import argparse
+from datetime import datetime
+from multiprocessing import freeze_support
+
+from utils.jobs import JobQueue, Scheduler, CANCELLED, QUEUED, RUNNING
+from utils.tracking import tracker_params
+
+def print_status(job_queue):
+    jobs = job_queue.jobs()
+    if len(jobs) == 0:
+        print(f"No job in {job_queue.folder}")
+        return
+    print(f"{'id':24s} {'status':10s} {'prio':>4s} {'tries':>5s}  {'updated':19s}  folder")
+    for job in jobs:
+        print(f"{job['id']:24s} {job['status']:10s} {job['priority']:4d} {job['attempts']:>2d}/{job['retries']+1:<2d}  {datetime.fromtimestamp(job['updated']):%Y-%m-%d %H:%M:%S}  {job['folder']}")
+        if job["error"]:
+            print(f"{'':24s} {job['error']}")
+
+if __name__ == "__main__":
+    freeze_support()
+    parser = argparse.ArgumentParser(description="Queue the tracking of recording sessions and run them on a pool of worker processes, e.g. overnight. The review page later replays the stored tracks.")
+    parser.add_argument("-q", "--queue", default=None, help="job folder (default: ~/.cache/semi-autolabeling/jobs)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="queue session folders")
+    add.add_argument("folders", nargs='+', help="folders containing synchronized videos of a recording session")
+    add.add_argument("-w", "--weights", required=True, help="YOLO box model (*.pt)")
+    add.add_argument("-p", "--priority", type=int, default=0, help="higher runs first")
+    add.add_argument("--retries", type=int, default=1, help="how many times a failed job is run again")
+    add.add_argument("-o", "--output", default=None, help="where to store the tracks (default: <folder>/tracks)")
+    add.add_argument("--iou", type=float, default=0.75, help="IoU threshold used during NMS")
+    add.add_argument("--conf", type=float, default=0.2, help="minimum box confidence")
+    add.add_argument("--track-high-thresh", type=float, default=0.5)
+    add.add_argument("--track-low-thresh", type=float, default=0.1)
+    add.add_argument("--new-track-thresh", type=float, default=0.5)
+    add.add_argument("--track-buffer", type=int, default=300)
+    add.add_argument("--match-thresh", type=float, default=0.8)
+    add.add_argument("--detect-stride", type=int, default=1, help="run detection on every n-th frame only, tracks are predicted in between")
+    add.add_argument("--interval", type=int, default=None, help="with --detect-stride, also detect on every n-th frame (the review page's interval)")
+    add.add_argument("--overlay", action='store_true', help="also write an annotated review video per camera")
+    add.add_argument("--backend", choices=['pytorch', 'onnx', 'openvino'], default='pytorch', help="run an ONNX Runtime or OpenVINO export of a .pt model")
+    add.add_argument("--int8", action='store_true', help="quantize the OpenVINO export to int8")
+    add.add_argument("--imgsz", default='1280', help="inference size: 640, auto or per camera, e.g. '1280, top=640'")
+    add.add_argument("--sync", default='index', help="how frames of the cameras are matched: index, timestamps or fps, with optional offsets, e.g. 'timestamps, side=0.4'")
+
+    run = commands.add_parser("run", help="run the queued jobs")
+    run.add_argument("-j", "--workers", type=int, default=1, help="number of jobs running side by side")
+    run.add_argument("--cores-per-job", type=int, default=0, help="cores each job is pinned to (default: all cores split between the workers)")
+    run.add_argument("--wait", action='store_true', help="keep waiting for new jobs instead of returning when the queue is empty")
+
+    commands.add_parser("status", help="list the jobs")
+    cancel = commands.add_parser("cancel", help="cancel jobs, running ones are stopped")
+    cancel.add_argument("ids", nargs='+')
+    retry = commands.add_parser("retry", help="queue failed or cancelled jobs again")
+    retry.add_argument("ids", nargs='+')
+    args = parser.parse_args()
+
+    job_queue = JobQueue(args.queue)
+    if args.command == "add":
+        params = tracker_params(args.track_high_thresh, args.track_low_thresh, args.new_track_thresh, args.track_buffer, args.match_thresh)
+        for folder in args.folders:
+            job = job_queue.add(folder, args.weights, args.priority, args.retries, output_dir=args.output, conf_thresh=args.conf, iou_thresh=args.iou, params=params, detect_stride=args.detect_stride, overlay=args.overlay, backend=args.backend, int8=args.int8, imgsz=args.imgsz, sync=args.sync, interval=args.interval)
+            print(f"{job['id']}: {job['folder']}")
+    elif args.command == "run":
+        Scheduler(job_queue, args.workers, args.cores_per_job).run(wait=args.wait)
+        print_status(job_queue)
+    elif args.command == "status":
+        print_status(job_queue)
+    elif args.command in ("cancel", "retry"):
+        for job_id in args.ids:
+            job = job_queue.load(job_id)
+            if args.command == "cancel" and job["status"] in (QUEUED, RUNNING):
+                job_queue.set_status(job_id, CANCELLED)
+            elif args.command == "retry" and job["status"] not in (QUEUED, RUNNING):
+                job["attempts"] = 0
+                job["status"] = QUEUED
+                job["error"] = None
+                job_queue.save(job)
+        print_status(job_queue)
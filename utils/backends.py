@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import shutil
+import numpy as np
+from utils.track_store import model_digest, writable_folder
+from utils.video import VideoReader
+
+## backend and int8 quantization of each choice of the parameter page
+BACKEND_OPTIONS = {'PyTorch': ('pytorch', False), 'ONNX Runtime': ('onnx', False), 'OpenVINO': ('openvino', False), 'OpenVINO int8': ('openvino', True)}
+
+def export_folders(weight_name):
+    """Where exported models are kept: beside the weights, or the user cache when that folder is read-only"""
+    return [os.path.join(os.path.dirname(os.path.abspath(weight_name)), 'exported'), os.path.join(os.path.expanduser('~'), '.cache', 'semi-autolabeling', 'models')]
+
+def exported_name(weight_name, backend, int8=False, imgsz=1280):
+    stem = os.path.splitext(os.path.basename(weight_name))[0]
+    name = f"{stem}-{model_digest(weight_name)[:8]}-{backend}{'-int8' if int8 else ''}-{imgsz}"
+    return name+'.onnx' if backend == 'onnx' else name+'_openvino_model'
+
+def fixed_sizes(imgsz, count):
+    """Inference size of each of `count` cameras from one size or a list (see tracking.parse_imgsz), 'auto'
+    counting as the largest size it can pick"""
+    from utils.tracking import AUTO_SIZES
+    sizes = list(imgsz) if isinstance(imgsz, (list, tuple)) else [imgsz]*count
+    return [max(AUTO_SIZES) if size == 'auto' else int(size) for size in sizes]
+
+def sample_frames(videos, count):
+    """About `count` BGR frames spread evenly over the videos"""
+    frames = []
+    for video in videos:
+        reader = VideoReader(video)
+        for target in np.linspace(0, max(0, reader.frame_count-1), max(1, count//len(videos))).astype(int):
+            if reader.seek(int(target)):
+                success, frame = reader.read()
+                if success:
+                    frames.append(frame)
+        reader.release()
+    return frames
+
+def calibration_set(videos, folder, names, count=300):
+    """Writes frames of the session and a dataset yaml to calibrate int8 quantization on, returns the yaml"""
+    import cv2
+    import yaml
+    images = os.path.join(folder, 'images')
+    os.makedirs(images, exist_ok=True)
+    for i, frame in enumerate(sample_frames(videos, count)):
+        cv2.imwrite(os.path.join(images, f'{i:05d}.jpg'), frame)
+    path = os.path.join(folder, 'calibration.yaml')
+    with open(path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump({'path': folder, 'train': 'images', 'val': 'images', 'names': dict(names)}, f)
+    return path
+
+def export_model(weight_name, backend, int8=False, imgsz=1280, videos=None, calibration_frames=300):
+    """Path of the model to run with `backend`: the .pt itself for pytorch, otherwise its ONNX / OpenVINO
+    export (int8 quantization needs OpenVINO and is calibrated on frames of `videos`). Exports are made once
+    and reused. Input shapes are dynamic, so all the cameras still go through in one batch."""
+    if backend == 'pytorch':
+        return weight_name
+    if int8 and backend != 'openvino':
+        raise Exception("int8 quantization is only available with OpenVINO")
+    name = exported_name(weight_name, backend, int8, imgsz)
+    folders = export_folders(weight_name)
+    for folder in folders:
+        if os.path.exists(os.path.join(folder, name)):
+            return os.path.join(folder, name)
+    folder = writable_folder(folders)
+    if folder is None:
+        raise Exception(f"None of {folders} is writable")
+
+    ## ultralytics writes the export beside the weights, so it runs on a copy in the target folder
+    from ultralytics import YOLO
+    work = os.path.join(folder, name+'-export')
+    os.makedirs(work, exist_ok=True)
+    model = YOLO(shutil.copy(weight_name, work))
+    options = {}
+    if int8:
+        if not videos:
+            raise Exception("int8 quantization needs videos to calibrate on")
+        options = {'int8': True, 'data': calibration_set(videos, os.path.join(folder, name+'-calibration'), model.names, calibration_frames)}
+    exported = model.export(format=backend, imgsz=imgsz, dynamic=True, **options)
+    target = os.path.join(folder, name)
+    shutil.move(exported, target)
+    shutil.rmtree(work, ignore_errors=True)
+    return target
+
+def accuracy_report(weight_name, model_path, videos, frames=100, imgsz=1280, conf_thresh=0.2, iou_thresh=0.75):
+    """Boxes of an exported model against its .pt on frames of the session (both on CPU), with the time per frame.
+    Frames of each video go through at its inference size (one or a list, see fixed_sizes)."""
+    from ultralytics import YOLO
+    from utils.evaluation import compare_detections
+    samples = [(frame, size) for video, size in zip(videos, fixed_sizes(imgsz, len(videos))) for frame in sample_frames([video], max(1, frames//len(videos)))]
+    boxes = {}
+    report = {}
+    for run, path in (('reference', weight_name), ('candidate', model_path)):
+        model = YOLO(path, task='detect')
+        model.predict(samples[0][0], imgsz=samples[0][1], device='cpu', verbose=False)  # warm-up
+        start = time.perf_counter()
+        results = [model.predict(frame, imgsz=size, conf=conf_thresh, iou=iou_thresh, half=False, device='cpu', verbose=False)[0] for frame, size in samples]
+        report[run+'_ms'] = (time.perf_counter()-start)*1000/max(1, len(samples))
+        boxes[run] = [result.boxes.xywh.cpu().numpy() for result in results]
+    report.update(compare_detections(boxes['reference'], boxes['candidate']))
+    return report
+
+def prepare_model(weight_name, backend, int8=False, videos=None, imgsz=1280, conf_thresh=0.2, iou_thresh=0.75):
+    """Exports the model if needed and measures it against the .pt once at the inference sizes tracking uses
+    (`imgsz`: one size or one per video, kept in <model>.report-<sizes>.json). The export is made at the
+    largest of them, its input shape is dynamic. Returns (model path, report or None)."""
+    sizes = fixed_sizes(imgsz, len(videos) if videos else 1)
+    model_path = export_model(weight_name, backend, int8, max(sizes), videos)
+    if model_path == weight_name:
+        return model_path, None
+    report_path = model_path+f".report-{'-'.join(str(size) for size in sorted(set(sizes)))}.json"
+    if os.path.isfile(report_path):
+        with open(report_path, 'r', encoding='utf-8') as f:
+            return model_path, json.load(f)
+    report = accuracy_report(weight_name, model_path, videos, imgsz=sizes, conf_thresh=conf_thresh, iou_thresh=iou_thresh)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    return model_path, report
+
+def describe_report(report):
+    return f"recall {report['recall']:.3f}, precision {report['precision']:.3f}, IoU {report['mean_iou']:.3f} against the .pt, {report['candidate_ms']:.0f} vs {report['reference_ms']:.0f} ms/frame on CPU"
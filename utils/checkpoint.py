@@ -0,0 +1,78 @@
+import os
+import json
+import base64
+import threading
+
+CHECKPOINT_NAME = 'checkpoint.json'
+
+def save_checkpoint(output_dir, session, confirmed, mappings, tracker_states):
+    """Writes the state of a session after a Confirm to <output_dir>/checkpoint.json.
+    `session` holds the inputs of the session (videos, weights, parameters, names, ...), `confirmed` the last
+    confirmed frame of each camera and `tracker_states` the ByteTrack snapshots taken at those frames.
+    The file is replaced atomically, so a crash never leaves a half-written checkpoint."""
+    checkpoint = dict(session)
+    checkpoint["output_dir"] = output_dir
+    checkpoint["confirmed"] = [int(cnt) for cnt in confirmed]
+    checkpoint["mappings"] = [{str(key): int(value) for key, value in mapping.items()} for mapping in mappings]
+    checkpoint["tracker_states"] = [base64.b64encode(state).decode('ascii') if state is not None else None for state in tracker_states]
+
+    path = os.path.join(output_dir, CHECKPOINT_NAME)
+    tmp = path+'.part'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path
+
+def load_checkpoint(path):
+    """Reads a checkpoint written by save_checkpoint. The tracker states stay pickled bytes here, the tracker
+    processes unpickle them (see tracking.load_tracker), which can run code: checkpoints are trusted like
+    the session's own files, only open those written by this tool on a machine you trust."""
+    with open(path, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    checkpoint["mappings"] = [{int(key): value for key, value in mapping.items()} for mapping in checkpoint["mappings"]]
+    checkpoint["tracker_states"] = [base64.b64decode(state) if state is not None else None for state in checkpoint["tracker_states"]]
+    return checkpoint
+
+class CheckpointWriter:
+    """Writes checkpoints on a background thread, so Confirm doesn't wait for the disk. Only the latest
+    checkpoint matters: one submitted while another is being written replaces any still waiting.
+    close() writes the last one before returning."""
+    def __init__(self):
+        self.latest = None
+        self.closed = False
+        self.errors = 0
+        self.condition = threading.Condition()
+        self.worker = threading.Thread(target=self.__work, daemon=True)
+        self.worker.start()
+
+    def submit(self, output_dir, session, confirmed, mappings, tracker_states, flushed=None):
+        """Same arguments as save_checkpoint; the mappings are copied, they can change right after.
+        `flushed` (see CropWriter.barrier) is waited for before writing, so a checkpoint never claims frames
+        whose crops aren't on disk yet."""
+        with self.condition:
+            self.latest = (output_dir, dict(session), list(confirmed), [dict(mapping) for mapping in mappings], list(tracker_states), flushed)
+            self.condition.notify()
+
+    def __work(self):
+        while True:
+            with self.condition:
+                while self.latest is None and not self.closed:
+                    self.condition.wait()
+                if self.latest is None:
+                    break
+                item, self.latest = self.latest, None
+            try:
+                if item[-1] is not None:
+                    item[-1]()
+                save_checkpoint(*item[:-1])
+            except Exception as e:
+                print(e)
+                self.errors += 1
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.worker.join()
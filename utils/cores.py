@@ -0,0 +1,52 @@
+import os
+import time
+
+def available_cores():
+    return sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+
+def partition_cores(workers, cores_per_job=0, reserve=0):
+    """Sets of cores for `workers` processes running side by side, disjoint as long as there are enough
+    cores. The first `reserve` cores are left out (for the UI); all the others are split evenly by default."""
+    cores = available_cores()
+    if len(cores) > reserve:
+        cores = cores[reserve:]
+    size = cores_per_job if cores_per_job > 0 else max(1, len(cores)//max(1, workers))
+    return [[cores[(i*size+j)%len(cores)] for j in range(min(size, len(cores)))] for i in range(workers)]
+
+def pin_process(cores=None, threads=None):
+    """Keeps the calling process on `cores` and sizes the torch / OpenCV thread pools to match, so that
+    processes running side by side don't oversubscribe the CPU. `threads` overrides the pool size."""
+    if cores is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    threads = threads if threads is not None else (len(cores) if cores is not None else None)
+    if threads is None:
+        return
+    import cv2
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+class RateMeter:
+    """Frames per second over the last `period` seconds, written to a shared value for the UI"""
+    def __init__(self, value=None, period=1.0):
+        self.value = value
+        self.period = period
+        self.count = 0
+        self.start = time.perf_counter()
+
+    def tick(self, frames=1):
+        if self.value is None:
+            return
+        self.count += frames
+        elapsed = time.perf_counter()-self.start
+        if elapsed >= self.period:
+            self.value.value = self.count/elapsed
+            self.count = 0
+            self.start = time.perf_counter()
+
+    def stop(self):
+        if self.value is not None:
+            self.value.value = 0
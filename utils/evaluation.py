@@ -0,0 +1,87 @@
+from collections import Counter, defaultdict
+import numpy as np
+
+def box_iou(a, b):
+    """IoU matrix between two sets of xywh (center) boxes"""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    a1, a2 = a[:, None, :2]-a[:, None, 2:]/2, a[:, None, :2]+a[:, None, 2:]/2
+    b1, b2 = b[None, :, :2]-b[None, :, 2:]/2, b[None, :, :2]+b[None, :, 2:]/2
+    inter = np.clip(np.minimum(a2, b2)-np.maximum(a1, b1), 0, None).prod(axis=2)
+    union = a[:, None, 2:].prod(axis=2)+b[None, :, 2:].prod(axis=2)-inter
+    return inter/np.maximum(union, 1e-9)
+
+def match_boxes(a, b, iou_thresh=0.5):
+    """Greedy one-to-one matching by IoU. Returns a list of (index in a, index in b)"""
+    if len(a) == 0 or len(b) == 0:
+        return []
+    iou = box_iou(a, b)
+    pairs = []
+    used_a, used_b = set(), set()
+    for k in np.argsort(-iou, axis=None):
+        i, j = np.unravel_index(k, iou.shape)
+        if iou[i, j] < iou_thresh:
+            break
+        if i in used_a or j in used_b:
+            continue
+        used_a.add(i)
+        used_b.add(j)
+        pairs.append((int(i), int(j)))
+    return pairs
+
+def compare_tracks(reference, candidate, frames=None, iou_thresh=0.5):
+    """Compares the tracks of a candidate run (e.g. strided detection) against a reference run
+    (per-frame detection). Both are TrackReader objects.
+
+    recall:       fraction of reference boxes matched by a candidate box
+    id_switches:  number of times the candidate id following a reference track changes
+    consistency:  fraction of matched boxes carrying the majority candidate id of their reference track
+    """
+    if frames is None:
+        frames = range(min(len(reference), len(candidate)))
+    total = 0
+    matched = 0
+    followed = defaultdict(list)
+    for cnt in frames:
+        ref_boxes, ref_ids, _, _ = reference.get(cnt)
+        cand_boxes, cand_ids, _, _ = candidate.get(cnt)
+        total += len(ref_boxes)
+        for i, j in match_boxes(ref_boxes, cand_boxes, iou_thresh):
+            matched += 1
+            followed[ref_ids[i]].append(cand_ids[j])
+
+    id_switches = sum([sum([a != b for a, b in zip(ids[:-1], ids[1:])]) for ids in followed.values()])
+    majority = sum([Counter(ids).most_common(1)[0][1] for ids in followed.values()])
+    return {
+        "frames": len(frames),
+        "reference_boxes": total,
+        "recall": matched/total if total > 0 else 1.0,
+        "id_switches": int(id_switches),
+        "consistency": majority/matched if matched > 0 else 1.0,
+    }
+
+def compare_detections(reference, candidate, iou_thresh=0.5):
+    """Compares the boxes of two detectors (e.g. an exported model against its .pt) on the same frames.
+    reference, candidate: lists of xywh box arrays, one per frame.
+
+    recall:     fraction of reference boxes matched by a candidate box
+    precision:  fraction of candidate boxes matching a reference box
+    mean_iou:   mean IoU of the matched boxes
+    """
+    total_ref, total_cand, matched, iou_sum = 0, 0, 0, 0.
+    for ref_boxes, cand_boxes in zip(reference, candidate):
+        total_ref += len(ref_boxes)
+        total_cand += len(cand_boxes)
+        pairs = match_boxes(ref_boxes, cand_boxes, iou_thresh)
+        matched += len(pairs)
+        if len(pairs) > 0:
+            iou = box_iou(ref_boxes, cand_boxes)
+            iou_sum += float(sum([iou[i, j] for i, j in pairs]))
+    return {
+        "frames": len(reference),
+        "reference_boxes": total_ref,
+        "candidate_boxes": total_cand,
+        "recall": matched/total_ref if total_ref > 0 else 1.0,
+        "precision": matched/total_cand if total_cand > 0 else 1.0,
+        "mean_iou": iou_sum/matched if matched > 0 else 1.0,
+    }
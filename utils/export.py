@@ -0,0 +1,280 @@
+import os
+import io
+import csv
+import queue
+import tarfile
+import importlib.util
+import threading
+import cv2
+import numpy as np
+from utils.profiler import DISABLED
+
+EXTENSIONS = {'png': '.png', 'jpg': '.jpg', 'webp': '.webp'}
+
+def clip_box(rect, shape):
+    """(x1, y1, x2, y2) of a xywh (center) box clipped to a frame of `shape`, or None if nothing is left"""
+    x, y, w, h = rect
+    x1, y1 = max(0, int(x-w/2)), max(0, int(y-h/2))
+    x2, y2 = min(shape[1], int(x+w/2)), min(shape[0], int(y+h/2))
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
+
+def encode_params(fmt, quality):
+    if fmt == 'jpg':
+        return [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if fmt == 'webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    return []
+
+class FileSink:
+    """One file per crop in <output_dir>/<label>/"""
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+    def write(self, label, name, data):
+        os.makedirs(os.path.join(self.output_dir, label), exist_ok=True)
+        with open(os.path.join(self.output_dir, label, name), 'wb') as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+class TarSink:
+    """Crops packed in tar shards of `shard_size` members (<output_dir>/crops_00000.tar, ...), with an index
+    crops_index.csv of (shard, member, label)"""
+    def __init__(self, output_dir, shard_size=10000):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        os.makedirs(output_dir, exist_ok=True)
+        self.shard = -1
+        self.count = 0
+        self.tar = None
+        index_path = os.path.join(output_dir, 'crops_index.csv')
+        new_index = not os.path.isfile(index_path)
+        self.index_file = open(index_path, 'a', newline='', encoding='utf-8')
+        self.index = csv.writer(self.index_file)
+        if new_index:
+            self.index.writerow(['shard', 'member', 'label'])
+        while os.path.isfile(self.__shard_path(self.shard+1)):
+            self.shard += 1     # never append to the shards of an earlier run
+
+    def __shard_path(self, shard):
+        return os.path.join(self.output_dir, f'crops_{shard:05d}.tar')
+
+    def write(self, label, name, data):
+        if self.tar is None or self.count >= self.shard_size:
+            if self.tar is not None:
+                self.tar.close()
+            self.shard += 1
+            self.count = 0
+            self.tar = tarfile.open(self.__shard_path(self.shard), 'w')
+        member = f'{label}/{name}'
+        info = tarfile.TarInfo(member)
+        info.size = len(data)
+        self.tar.addfile(info, io.BytesIO(data))
+        self.count += 1
+        self.index.writerow([os.path.basename(self.__shard_path(self.shard)), member, label])
+
+    def close(self):
+        if self.tar is not None:
+            self.tar.close()
+        self.index_file.close()
+
+class HDF5Sink:
+    """All crops in a single <output_dir>/crops.h5: encoded images in `images`, indexed by `keys` (label/name)
+    and `labels`. Needs h5py."""
+    def __init__(self, output_dir, chunk=1024):
+        import h5py
+        os.makedirs(output_dir, exist_ok=True)
+        self.file = h5py.File(os.path.join(output_dir, 'crops.h5'), 'a')
+        self.chunk = chunk
+        if 'images' not in self.file:
+            self.file.create_dataset('images', (0,), maxshape=(None,), chunks=(chunk,), dtype=h5py.vlen_dtype(np.uint8))
+            self.file.create_dataset('keys', (0,), maxshape=(None,), chunks=(chunk,), dtype=h5py.string_dtype())
+            self.file.create_dataset('labels', (0,), maxshape=(None,), chunks=(chunk,), dtype=h5py.string_dtype())
+        self.count = self.file['images'].shape[0]
+
+    def write(self, label, name, data):
+        for key in ('images', 'keys', 'labels'):
+            if self.file[key].shape[0] <= self.count:
+                self.file[key].resize((self.count+self.chunk,))
+        self.file['images'][self.count] = np.frombuffer(data, dtype=np.uint8)
+        self.file['keys'][self.count] = f'{label}/{name}'
+        self.file['labels'][self.count] = label
+        self.count += 1
+
+    def close(self):
+        for key in ('images', 'keys', 'labels'):
+            self.file[key].resize((self.count,))
+        self.file.close()
+
+SINKS = {'files': FileSink, 'tar': TarSink, 'hdf5': HDF5Sink}
+
+def available_containers():
+    """Containers whose dependencies are installed (hdf5 needs h5py)"""
+    return [name for name in SINKS if name != 'hdf5' or importlib.util.find_spec('h5py') is not None]
+
+class CropWriter:
+    """Encodes and writes labeled crops on a pool of worker threads, so Confirm never waits for compression.
+    fmt: png, jpg or webp; quality: 0-100 for jpg / webp; size: (w, h) to resize every crop to, None to keep
+    the box size; container: files, tar or hdf5. The time to encode and write each crop goes to `profiler`.
+    At most `maxsize` crops submitted with block=True (the track export) wait in the queue; crops submitted
+    with block=False (Confirm) are always queued right away."""
+    def __init__(self, output_dir, fmt='png', quality=95, size=None, container='files', workers=4, maxsize=256, profiler=DISABLED):
+        self.fmt = fmt
+        self.profiler = profiler
+        self.params = encode_params(fmt, quality)
+        self.size = size
+        self.sink = SINKS[container](output_dir)
+        self.sink_lock = threading.Lock()
+        self.inbox = queue.Queue()
+        self.slots = threading.BoundedSemaphore(maxsize)
+        self.errors = 0
+        ## sequence numbers of the crops submitted and not written yet, for barrier()
+        self.state = threading.Condition()
+        self.submitted = 0
+        self.outstanding = set()
+        self.workers = [threading.Thread(target=self.__work, daemon=True) for _ in range(max(1, workers))]
+        for worker in self.workers:
+            worker.start()
+
+    def __work(self):
+        while True:
+            item = self.inbox.get()
+            if item is None:
+                break
+            seq, crop, label, name, rgb, bounded = item
+            start = self.profiler.start()
+            try:
+                if rgb:
+                    crop = cv2.cvtColor(crop, cv2.COLOR_RGB2BGR)
+                if self.size is not None:
+                    crop = cv2.resize(crop, self.size, interpolation=cv2.INTER_AREA)
+                success, data = cv2.imencode(EXTENSIONS[self.fmt], crop, self.params)
+                if not success:
+                    raise Exception(f"Couldn't encode {name}")
+                with self.sink_lock:
+                    self.sink.write(label, name+EXTENSIONS[self.fmt], data.tobytes())
+                    self.profiler.stop('crop_write', None, start)
+            except Exception as e:
+                print(e)
+                self.errors += 1
+            if bounded:
+                self.slots.release()
+            with self.state:
+                self.outstanding.discard(seq)
+                self.state.notify_all()
+
+    def submit(self, frame, rect, label, name, rgb=True, block=True):
+        """Queues the crop of a xywh box of a frame (RGB, or BGR with rgb=False). The crop is copied, so the
+        frame can be reused right away. With block=True, waits while `maxsize` such crops are queued."""
+        box = clip_box(rect, frame.shape)
+        if box is None:
+            return False
+        x1, y1, x2, y2 = box
+        if block:
+            self.slots.acquire()
+        with self.state:
+            seq = self.submitted
+            self.submitted += 1
+            self.outstanding.add(seq)
+        self.inbox.put((seq, frame[y1:y2, x1:x2].copy(), label, name, rgb, block))
+        return True
+
+    def barrier(self):
+        """Function waiting until every crop submitted so far is written (or failed)"""
+        with self.state:
+            mark = self.submitted
+
+        def wait():
+            with self.state:
+                while len(self.outstanding) > 0 and min(self.outstanding) < mark:
+                    self.state.wait()
+        return wait
+
+    @property
+    def pending(self):
+        return self.inbox.qsize()
+
+    def close(self):
+        """Waits for the queued crops to be written"""
+        for _ in self.workers:
+            self.inbox.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.sink.close()
+
+class TrackExporter:
+    """Streams the crops of every frame of the labeled tracks, not only of the sampled frame.
+    On Confirm, the boxes the tracker computed since the previous sampled frame (its window) are submitted with
+    the names of the labeled ids; a worker thread decodes that part of the video once and hands the crops of
+    every `rate`-th frame to the CropWriter. With `sync` (see sync.session_sync), frames are timeline steps."""
+    def __init__(self, videos, crop_writer, rate=1, sync=None):
+        from utils.video import VideoReader, SyncedReader
+        self.readers = [VideoReader(video) if sync is None or sync[i] is None else SyncedReader(video, sync[i]) for i, video in enumerate(videos)]
+        self.stems = [os.path.basename(video).split('.')[0] for video in videos]
+        self.crop_writer = crop_writer
+        self.rate = max(1, rate)
+        self.inbox = queue.Queue()
+        self.state = threading.Condition()
+        self.submitted = 0
+        self.exported = 0
+        self.worker = threading.Thread(target=self.__work, daemon=True)
+        self.worker.start()
+
+    def submit(self, camera, window, labels):
+        """window: (frame, xywh, id) arrays, labels: {track id: name} of the labeled ids"""
+        if window is None or len(labels) == 0:
+            return
+        frames, xywh, ids = window
+        keep = np.isin(ids, list(labels.keys())) & (frames % self.rate == 0)
+        if keep.any():
+            with self.state:
+                self.submitted += 1
+            self.inbox.put((camera, frames[keep], xywh[keep], ids[keep], dict(labels)))
+
+    def barrier(self):
+        """Function waiting until every window submitted so far is exported and its crops written"""
+        with self.state:
+            mark = self.submitted
+
+        def wait():
+            with self.state:
+                while self.exported < mark:
+                    self.state.wait()
+            self.crop_writer.barrier()()
+        return wait
+
+    def __work(self):
+        while True:
+            item = self.inbox.get()
+            if item is None:
+                break
+            camera, frames, xywh, ids, labels = item
+            reader = self.readers[camera]
+            try:
+                for cnt in np.unique(frames):
+                    if not reader.seek(int(cnt)):
+                        break
+                    success, frame = reader.read()
+                    if not success:
+                        break
+                    for rect, id in zip(xywh[frames == cnt], ids[frames == cnt]):
+                        self.crop_writer.submit(frame, rect, labels[int(id)], f"{cnt}_{self.stems[camera]}", rgb=False)
+            except Exception as e:
+                print(e)
+            with self.state:
+                self.exported += 1
+                self.state.notify_all()
+
+    @property
+    def pending(self):
+        return self.inbox.qsize()
+
+    def close(self):
+        """Waits for the submitted windows to be exported"""
+        self.inbox.put(None)
+        self.worker.join()
+        for reader in self.readers:
+            reader.release()
@@ -0,0 +1,131 @@
+import queue
+import threading
+from multiprocessing import Queue
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+
+def attach_shared_memory(name):
+    """Attaches to a block created by another process. Child processes share the resource tracker of the
+    session, so the block is unlinked once, by its owner."""
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:   # python < 3.13
+        return SharedMemory(name=name)
+
+class MemoryBudget:
+    """Bytes of frames that all the frame rings of a session may hold together. The prefetch depth of each
+    ring is cut down to fit `limit` before the ring is allocated, so the budget only keeps count of what is
+    allocated (shown in the status line); nothing waits on it."""
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def add(self, nbytes):
+        with self.lock:
+            self.used += nbytes
+
+    def release(self, nbytes):
+        with self.lock:
+            self.used -= nbytes
+
+class SharedFrameRing:
+    """Preallocated shared-memory slots for the frames of one camera.
+    The tracker process writes a frame into a free slot (acquire / publish) and only the slot index and the
+    box metadata go through the control queue. The review page gets a numpy view of the slot, which stays
+    valid until its next get(); only then the slot goes back to the tracker.
+    Has the put / get / qsize / drain interface of a queue."""
+    def __init__(self, shape, depth=8, poll=0.1):
+        self.shape = tuple(shape)
+        self.maxsize = depth
+        self.slots = depth+1    # one more for the frame on display
+        self.poll = poll
+        self.memory = SharedMemory(create=True, size=self.slots*int(np.prod(self.shape)))
+        self.owner = True
+        self.free = Queue()
+        for slot in range(self.slots):
+            self.free.put(slot)
+        self.ready = Queue()
+        self.held = None
+        self.__attach()
+
+    def __attach(self):
+        self.frames = np.ndarray((self.slots,)+self.shape, dtype=np.uint8, buffer=self.memory.buf)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['memory'], state['frames']
+        state['name'] = self.memory.name
+        state['owner'] = False
+        state['held'] = None
+        return state
+
+    def __setstate__(self, state):
+        name = state.pop('name')
+        self.__dict__.update(state)
+        self.memory = attach_shared_memory(name)
+        self.__attach()
+
+    @property
+    def nbytes(self):
+        return self.memory.size
+
+    ## producer side
+    def acquire(self, running=None):
+        """Returns a free slot index, or None if the session stopped while waiting for one"""
+        while running is None or running.value:
+            try:
+                return self.free.get(timeout=self.poll)
+            except queue.Empty:
+                pass
+        return None
+
+    def publish(self, slot, boxes, track_ids, cnt, state=None, window=None):
+        self.ready.put((slot, boxes, track_ids, cnt, state, window))
+
+    def put(self, item, running=None):
+        if item is None:
+            self.ready.put(None)
+            return True
+        slot = self.acquire(running)
+        if slot is None:
+            return False
+        np.copyto(self.frames[slot], item[0])
+        self.publish(slot, *item[1:])
+        return True
+
+    ## consumer side
+    def get(self, block=True, timeout=None):
+        msg = self.ready.get(block, timeout)
+        self.release()
+        if msg is None:
+            return None
+        slot, boxes, track_ids, cnt, state, window = msg
+        self.held = slot
+        return (self.frames[slot], boxes, track_ids, cnt, state, window)
+
+    def release(self):
+        """Gives the slot of the last returned frame back to the producer"""
+        if self.held is not None:
+            self.free.put(self.held)
+            self.held = None
+
+    def qsize(self):
+        return self.ready.qsize()
+
+    def drain(self):
+        while True:
+            try:
+                self.get(block=False)
+            except queue.Empty:
+                break
+        self.release()
+
+    def close(self):
+        self.frames = None
+        try:
+            self.memory.close()
+        except BufferError:
+            pass    # views of the slots are still referenced, the block goes away with them
+        if self.owner:
+            self.memory.unlink()
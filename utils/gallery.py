@@ -0,0 +1,170 @@
+import os
+import queue
+import threading
+import cv2
+import numpy as np
+from utils.export import clip_box
+from utils.track_store import file_digest
+
+GALLERY_NAME = 'gallery.npz'
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors/np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+class Embedder:
+    """Appearance vectors of crops: pooled features of the box model's backbone (YOLO.embed)"""
+    def __init__(self, weight_name, imgsz=224):
+        from ultralytics import YOLO
+        self.model = YOLO(weight_name)
+        self.imgsz = imgsz
+
+    def __call__(self, crops):
+        """crops: list of BGR images -> (n, d) unit vectors"""
+        features = self.model.embed(crops, imgsz=self.imgsz, verbose=False)
+        return normalize(np.stack([feature.cpu().numpy().ravel() for feature in features]))
+
+class Gallery:
+    """Unit appearance vectors of every named individual, searched with one matrix product.
+    Keeps the last `max_per_name` vectors of each name and is stored as a single .npz, valid only for the
+    embedder it was built with (`key`)."""
+    def __init__(self, path, key, max_per_name=500):
+        self.path = path
+        self.key = key
+        self.max_per_name = max_per_name
+        self.vectors = None
+        self.names = np.zeros(0, dtype=object)
+        if os.path.isfile(path):
+            try:
+                data = np.load(path, allow_pickle=False)
+                if str(data['key']) == key:
+                    self.vectors = data['vectors']
+                    self.names = data['names'].astype(object)
+            except Exception as e:
+                print(f"Starting a new gallery, couldn't load {path}: {e}")
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, vectors, names):
+        vectors = normalize(vectors)
+        self.vectors = vectors if self.vectors is None else np.concatenate([self.vectors, vectors])
+        self.names = np.concatenate([self.names, np.asarray(names, dtype=object)])
+        ## drop the oldest vectors of the names over the limit
+        keep = np.ones(len(self.names), dtype=bool)
+        for name in set(names):
+            rows = np.flatnonzero(self.names == name)
+            keep[rows[:-self.max_per_name]] = False
+        if not keep.all():
+            self.vectors = self.vectors[keep]
+            self.names = self.names[keep]
+
+    def query(self, vectors, allowed=None, k=5):
+        """Nearest name of each vector by a vote of its k most similar gallery vectors, weighted by cosine
+        similarity. Returns (names, scores); the score is the summed similarity of the winning name over k,
+        None / 0 where nothing matches. `allowed` restricts the search to those names."""
+        vectors = normalize(vectors)
+        names = [None]*len(vectors)
+        scores = np.zeros(len(vectors), dtype=np.float32)
+        if len(self) == 0 or len(vectors) == 0:
+            return names, scores
+        candidates = np.isin(self.names, list(allowed)) if allowed is not None else np.ones(len(self.names), dtype=bool)
+        if not candidates.any():
+            return names, scores
+        gallery, gallery_names = self.vectors[candidates], self.names[candidates]
+        similarity = vectors @ gallery.T   # (n, m)
+        k = min(k, len(gallery_names))
+        nearest = np.argpartition(-similarity, k-1, axis=1)[:, :k]
+        for row in range(len(vectors)):
+            votes = {}
+            for column in nearest[row]:
+                votes[gallery_names[column]] = votes.get(gallery_names[column], 0)+max(0., float(similarity[row, column]))
+            name = max(votes, key=votes.get)
+            names[row], scores[row] = name, votes[name]/k
+        return names, scores
+
+    def save(self):
+        if self.vectors is None:
+            return
+        tmp = self.path+'.part'
+        with open(tmp, 'wb') as f:
+            np.savez(f, key=np.str_(self.key), vectors=self.vectors, names=self.names.astype(str))
+        os.replace(tmp, self.path)
+
+class NameSuggester:
+    """Suggests names for new track ids from a gallery of the crops labeled so far (in this and earlier
+    sessions writing to the same folder). Labeled crops and the crops of new ids are embedded on a background
+    thread, in the order they come, so the review page only cuts the crops; poll() returns the suggestions
+    computed since the last call. Frames are RGB, as shown on the review page."""
+    def __init__(self, weight_name, output_dir, threshold=0.6, k=5, save_every=20):
+        self.embedder = Embedder(weight_name)
+        self.gallery = Gallery(os.path.join(output_dir, GALLERY_NAME), f"{file_digest(weight_name)}-{self.embedder.imgsz}")
+        self.threshold = threshold
+        self.k = k
+        self.save_every = save_every
+        self.inbox = queue.Queue()
+        self.results = queue.Queue()
+        self.worker = threading.Thread(target=self.__work, daemon=True)
+        self.worker.start()
+
+    def __crops(self, frame, rects):
+        crops, rows = [], []
+        for row, rect in enumerate(rects):
+            box = clip_box(rect, frame.shape)
+            if box is not None:
+                x1, y1, x2, y2 = box
+                crops.append(cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_RGB2BGR))
+                rows.append(row)
+        return crops, rows
+
+    def suggest(self, key, frame, ids, rects, allowed=None):
+        """Queues the boxes `rects` (xywh) of the track `ids` of a frame; the crops are copied. poll() returns
+        (key, ids, names, scores) once they're embedded, with only the names over the threshold"""
+        crops, rows = self.__crops(frame, rects)
+        if len(crops) > 0:
+            self.inbox.put(('suggest', key, crops, [ids[row] for row in rows], allowed))
+
+    def poll(self):
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def learn(self, frame, rects, names):
+        """Queues labeled boxes of a frame to be added to the gallery; the crops are copied"""
+        crops, rows = self.__crops(frame, rects)
+        if len(crops) > 0:
+            self.inbox.put(('learn', crops, [names[row] for row in rows]))
+
+    def __suggest(self, key, crops, ids, allowed):
+        if len(self.gallery) == 0:
+            return
+        names, scores = self.gallery.query(self.embedder(crops), allowed=allowed, k=self.k)
+        found = [row for row, (name, score) in enumerate(zip(names, scores)) if name is not None and score >= self.threshold]
+        if len(found) > 0:
+            self.results.put((key, [ids[row] for row in found], [names[row] for row in found], [float(scores[row]) for row in found]))
+
+    def __work(self):
+        batches = 0
+        while True:
+            item = self.inbox.get()
+            if item is None:
+                break
+            try:
+                if item[0] == 'suggest':
+                    self.__suggest(*item[1:])
+                    continue
+                _, crops, names = item
+                self.gallery.add(self.embedder(crops), names)
+                batches += 1
+                if batches % self.save_every == 0:
+                    self.gallery.save()
+            except Exception as e:
+                print(e)
+
+    def close(self):
+        self.inbox.put(None)
+        self.worker.join()
+        self.gallery.save()
@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import glob
+import time
+import uuid
+import socket
+from datetime import datetime
+from multiprocessing import Process
+from utils.cores import partition_cores, pin_process
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+
+def default_queue_folder():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'semi-autolabeling', 'jobs')
+
+def process_alive(pid):
+    if os.name == 'nt':
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)    # PROCESS_QUERY_LIMITED_INFORMATION
+        if handle:
+            ctypes.windll.kernel32.CloseHandle(handle)
+        return bool(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class JobQueue:
+    """Tracking jobs of session folders, one <id>.json per job in `folder`, so adding a job never conflicts
+    with a runner updating another one. A job holds the arguments of headless.run (weights and tracker
+    parameters included, nothing is read from a shared file), a priority, a number of retries and its status.
+    A runner claims a job by renaming its file into `running/<id>@<host>@<pid>.json`: the rename is atomic, so
+    when several runners share the folder only one of them gets each job, and the file names its runner from
+    the moment it is claimed."""
+    def __init__(self, folder=None):
+        self.folder = folder if folder is not None else default_queue_folder()
+        self.running_folder = os.path.join(self.folder, 'running')
+        os.makedirs(self.running_folder, exist_ok=True)
+
+    def path(self, job_id):
+        """Where the job is now: in running/ while a runner has it claimed"""
+        running = glob.glob(os.path.join(self.running_folder, job_id+'*.json'))
+        return running[0] if len(running) > 0 else os.path.join(self.folder, job_id+'.json')
+
+    def runner(self, path):
+        """(host, pid) of the runner that claimed the job file at `path`, None for a job not claimed and
+        (None, None) for a claimed file that doesn't name its runner"""
+        if os.path.dirname(path) != self.running_folder:
+            return None
+        parts = os.path.basename(path)[:-len('.json')].split('@')
+        return (parts[1], int(parts[2])) if len(parts) == 3 else (None, None)
+
+    def log_path(self, job_id):
+        return os.path.join(self.folder, job_id+'.log')
+
+    def add(self, folder, weights, priority=0, retries=1, **options):
+        job = {
+            "id": datetime.now().strftime("%Y%m%d%H%M%S")+'-'+uuid.uuid4().hex[:6],
+            "folder": os.path.abspath(folder),
+            "weights": os.path.abspath(weights),
+            "options": options,
+            "priority": int(priority),
+            "retries": int(retries),
+            "attempts": 0,
+            "status": QUEUED,
+            "error": None,
+            "added": time.time(),
+            "updated": time.time(),
+        }
+        self.save(job)
+        return job
+
+    def save(self, job):
+        """Writes the job where it is; a claimed job that isn't running any more goes back to the queue folder"""
+        job["updated"] = time.time()
+        path = self.path(job["id"])
+        tmp = path+'.part'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(job, f, indent=1)
+        os.replace(tmp, path)
+        if job["status"] != RUNNING and os.path.dirname(path) == self.running_folder:
+            os.replace(path, os.path.join(self.folder, job["id"]+'.json'))
+
+    def claim(self, job_id):
+        """Marks a queued job as running for this process, False when another runner claimed it first or it
+        was cancelled in the meantime"""
+        try:
+            os.rename(os.path.join(self.folder, job_id+'.json'), os.path.join(self.running_folder, f"{job_id}@{socket.gethostname()}@{os.getpid()}.json"))
+        except OSError:
+            return False
+        job = self.load(job_id)
+        if job["status"] != QUEUED:
+            self.save(job)  # back to the queue folder
+            return False
+        job["status"] = RUNNING
+        self.save(job)
+        return True
+
+    def load(self, job_id):
+        with open(self.path(job_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def jobs(self, running=True):
+        """Every job, oldest first; only the ones not claimed by a runner with running=False"""
+        jobs = []
+        paths = glob.glob(os.path.join(self.folder, '*.json'))
+        if running:
+            paths += glob.glob(os.path.join(self.running_folder, '*.json'))
+        for path in paths:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    jobs.append(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Skipping {path}: {e}")
+        return sorted(jobs, key=lambda job: job["added"])
+
+    def next_job(self):
+        """Queued job of the highest priority, the oldest first"""
+        queued = [job for job in self.jobs(running=False) if job["status"] == QUEUED]
+        if len(queued) == 0:
+            return None
+        return min(queued, key=lambda job: (-job["priority"], job["added"]))
+
+    def set_status(self, job_id, status, error=None):
+        job = self.load(job_id)
+        job["status"] = status
+        job["error"] = error
+        self.save(job)
+        return job
+
+def run_job(job, cores, log_path):
+    """Entry point of a job process: pins it to its cores, sends its output to the job log and runs headless.run"""
+    log = open(log_path, 'a', buffering=1, encoding='utf-8')
+    sys.stdout = sys.stderr = log
+    print(f"==== {datetime.now():%Y-%m-%d %H:%M:%S} attempt {job['attempts']} on cores {cores}")
+    pin_process(cores)
+    from headless import run
+    options = dict(job["options"])
+    run(job["folder"], job["weights"], **options)
+
+class Scheduler:
+    """Runs the jobs of a queue on `workers` processes, each pinned to its own cores. A job that fails is
+    queued again until it has used its retries. Jobs added while it runs are picked up; it returns once
+    nothing is queued or running, or keeps waiting for new jobs with `wait`."""
+    def __init__(self, job_queue, workers=1, cores_per_job=0, poll=2):
+        self.queue = job_queue
+        self.slots = partition_cores(workers, cores_per_job)
+        self.poll = poll
+        self.running = [None]*workers   # (job id, process) of each slot
+
+    def recover(self):
+        """Jobs claimed by a runner of this machine that was killed, whatever their status, are put back in the
+        queue folder (running ones queued again); jobs of runners still alive (or on other machines sharing
+        the folder) are left alone"""
+        for job in self.queue.jobs():
+            runner = self.queue.runner(self.queue.path(job["id"]))
+            if runner is None and job["status"] != RUNNING:
+                continue
+            if runner is not None and runner[1] is not None and (runner[0] != socket.gethostname() or process_alive(runner[1])):
+                continue
+            if job["status"] in (RUNNING, QUEUED):
+                job["status"] = QUEUED
+            self.queue.save(job)    # saving a job that isn't running moves it out of running/
+
+    def __start(self, slot, job):
+        """Runs a queued job in a slot, False when another runner claimed it first"""
+        if not self.queue.claim(job["id"]):
+            return False
+        job = self.queue.load(job["id"])
+        job["attempts"] += 1
+        job["error"] = None
+        self.queue.save(job)
+        process = Process(target=run_job, args=(job, self.slots[slot], self.queue.log_path(job["id"])))
+        process.start()
+        self.running[slot] = (job["id"], process)
+        print(f"{job['id']}: started on cores {self.slots[slot]} ({job['folder']})")
+        return True
+
+    def __finish(self, slot):
+        job_id, process = self.running[slot]
+        self.running[slot] = None
+        job = self.queue.load(job_id)
+        if job["status"] == CANCELLED:
+            self.queue.save(job)    # back to the queue folder
+            print(f"{job_id}: cancelled")
+        elif process.exitcode == 0:
+            job["status"] = DONE
+            self.queue.save(job)
+            print(f"{job_id}: done")
+        else:
+            job["error"] = f"exit code {process.exitcode}, see {self.queue.log_path(job_id)}"
+            job["status"] = QUEUED if job["attempts"] <= job["retries"] else FAILED
+            self.queue.save(job)
+            print(f"{job_id}: failed ({job['error']}), {'queued again' if job['status'] == QUEUED else 'no retries left'}")
+
+    def run(self, wait=False):
+        self.recover()
+        try:
+            while True:
+                for slot, item in enumerate(self.running):
+                    if item is None:
+                        continue
+                    job_id, process = item
+                    if not process.is_alive():
+                        process.join()
+                        self.__finish(slot)
+                    elif self.queue.load(job_id)["status"] == CANCELLED:
+                        process.terminate()
+                for slot in range(len(self.running)):
+                    ## another runner may claim the job first, then the next one is tried
+                    while self.running[slot] is None:
+                        job = self.queue.next_job()
+                        if job is None or self.__start(slot, job):
+                            break
+                    if self.running[slot] is None:
+                        break
+                if not wait and all([item is None for item in self.running]) and self.queue.next_job() is None:
+                    break
+                time.sleep(self.poll)
+        except KeyboardInterrupt:
+            print("Stopping, the running jobs are queued again.")
+            for item in self.running:
+                if item is not None:
+                    item[1].terminate()
+                    item[1].join()
+                    self.queue.set_status(item[0], QUEUED)
@@ -0,0 +1,98 @@
+import os
+import queue
+from collections import defaultdict
+from multiprocessing import Process, Queue
+import cv2
+import numpy as np
+
+def draw_overlay(frame, boxes, track_ids, names, history, trail_length=90):
+    """Draws boxes, ids / assigned names and trails on a BGR frame in place.
+    `names` maps a track id to (name, RGB color), `history` keeps the trail points of each id."""
+    for box, track_id in zip(boxes, track_ids):
+        x, y, w, h = box
+        name, color = names.get(track_id, (None, (200,200,200)))
+        color = tuple(int(c) for c in color[::-1])
+        text = f"{track_id}: {name}" if name else str(track_id)
+
+        trail = history[track_id]
+        trail.append((float(x), float(y)))  # x, y center point
+        if len(trail) > trail_length:
+            trail.pop(0)
+        points = np.array(trail, dtype=np.int32).reshape((-1, 1, 2))
+        cv2.polylines(frame, [points], isClosed=False, color=color, thickness=4)
+
+        x1, y1, x2, y2 = int(x-w/2), int(y-h/2), int(x+w/2), int(y+h/2)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 3)
+        (tw, th), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 1, 2)
+        cv2.rectangle(frame, (x1, y1-th-10), (x1+tw+10, y1), (50,50,50), -1)
+        cv2.putText(frame, text, (x1+5, y1-5), cv2.FONT_HERSHEY_SIMPLEX, 1, (255,255,255), 2)
+    return frame
+
+def overlay_worker(videos, paths, fps, sync, inbox, updates):
+    """Decodes the frames of the boxes it gets from the trackers itself, so only boxes cross processes"""
+    from utils.video import VideoReader, SyncedReader
+    readers = [VideoReader(video) if sync is None or sync[i] is None else SyncedReader(video, sync[i]) for i, video in enumerate(videos)]
+    writers = [None]*len(paths)
+    histories = [defaultdict(lambda: []) for _ in paths]
+    names = [dict() for _ in paths]
+    while True:
+        item = inbox.get()
+        while True:
+            try:
+                camera, track_id, name, color = updates.get_nowait()
+                names[camera][track_id] = (name, color)
+            except queue.Empty:
+                break
+        if item is None:
+            break
+        camera, boxes, track_ids, cnt = item
+        reader = readers[camera]
+        if reader.position != cnt and not reader.seek(cnt):
+            continue
+        success, frame = reader.read()
+        if not success:
+            continue
+        if isinstance(reader, SyncedReader):
+            frame = frame.copy()    # a frame shown at several steps is returned again
+        if writers[camera] is None:
+            writers[camera] = cv2.VideoWriter(paths[camera], cv2.VideoWriter_fourcc(*'mp4v'), fps[camera], (frame.shape[1], frame.shape[0]))
+        writers[camera].write(draw_overlay(frame, boxes, track_ids, names[camera], histories[camera]))
+    for writer in writers:
+        if writer is not None:
+            writer.release()
+    for reader in readers:
+        reader.release()
+
+class OverlayExporter:
+    """Writes an annotated review video per camera in its own encoder process.
+    Trackers submit() the boxes of every frame, and the encoder process decodes the videos itself, so trackers
+    keep skipping the frames they don't detect on. No frame is dropped: a tracker only waits when the encoder
+    is `maxsize` frames behind. With `sync` (see sync.session_sync), frames are timeline steps.
+    Names assigned on the review page are sent with set_name()."""
+    def __init__(self, videos, output_dir, sync=None, maxsize=4096):
+        os.makedirs(output_dir, exist_ok=True)
+        self.paths = [os.path.join(output_dir, os.path.basename(video).split('.')[0]+'_overlay.mp4') for video in videos]
+        fps = []
+        for video in videos:
+            cap = cv2.VideoCapture(video)
+            fps.append(cap.get(cv2.CAP_PROP_FPS) or 30)
+            cap.release()
+        self.inbox = Queue(maxsize)
+        self.updates = Queue()
+        self.process = Process(target=overlay_worker, args=(videos, self.paths, fps, sync, self.inbox, self.updates), daemon=True)
+        self.process.start()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['process']
+        return state
+
+    def submit(self, camera, boxes, track_ids, cnt):
+        self.inbox.put((camera, np.asarray(boxes, dtype=np.float32), list(track_ids), cnt))
+
+    def set_name(self, camera, track_id, name, color):
+        self.updates.put((camera, track_id, name, color))
+
+    def close(self):
+        self.inbox.put(None)
+        self.process.join()
@@ -0,0 +1,128 @@
+import os
+import csv
+import json
+import time
+import platform
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+
+## stages of the labeling pipeline, in order
+STAGES = ('decode', 'inference', 'tracking', 'queue_put', 'queue_get', 'render', 'confirm', 'crop_write')
+STAGE_INDEX = {stage: i for i, stage in enumerate(STAGES)}
+## bucket k of a histogram counts durations in [2**k, 2**(k+1)) microseconds, the last one everything longer
+BUCKETS = 24
+COUNT, TOTAL, MAX = 0, 1, 2
+
+class StageProfiler:
+    """Counters (count, total and max seconds) and log2 histograms of the duration of each stage, per camera.
+    They live in shared memory, so the tracker processes and the review page all write to the same table:
+    every cell has a single writer (the process or thread running that stage for that camera). The row after
+    the last camera holds what belongs to no camera (the whole review page, crop writes).
+    A disabled profiler keeps no table; start() and stop() return right away."""
+    def __init__(self, cameras, enabled=True):
+        self.cameras = cameras
+        self.enabled = enabled
+        self.stats = RawArray('d', (cameras+1)*len(STAGES)*(3+BUCKETS)) if enabled else None
+        self.__attach()
+
+    def __attach(self):
+        self.table = np.frombuffer(self.stats, dtype=np.float64).reshape(self.cameras+1, len(STAGES), 3+BUCKETS) if self.enabled else None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['table']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__attach()
+
+    def start(self):
+        return time.perf_counter() if self.enabled else 0.
+
+    def stop(self, stage, camera, start):
+        """Adds the time since `start` (see start()) to a stage of a camera, None for no camera"""
+        if self.enabled:
+            self.add(stage, camera, time.perf_counter()-start)
+
+    def add(self, stage, camera, seconds):
+        if not self.enabled:
+            return
+        row = self.table[self.cameras if camera is None else camera, STAGE_INDEX[stage]]
+        row[COUNT] += 1
+        row[TOTAL] += seconds
+        if seconds > row[MAX]:
+            row[MAX] = seconds
+        row[3+min(BUCKETS-1, max(0, int(seconds*1e6).bit_length()-1))] += 1
+
+    def __cells(self, names=None):
+        """(stage, camera name, counters) of every stage that ran, 'all' for the row of no camera"""
+        if not self.enabled:
+            return
+        for camera in range(self.cameras+1):
+            for stage in STAGES:
+                row = self.table[camera, STAGE_INDEX[stage]]
+                if row[COUNT] > 0:
+                    yield stage, 'all' if camera == self.cameras else (names[camera] if names is not None else camera), row
+
+    def summary(self, names=None):
+        """One dict per (stage, camera) that ran: count, total seconds, mean / p50 / p95 / max milliseconds"""
+        return [{
+            "stage": stage,
+            "camera": camera,
+            "count": int(row[COUNT]),
+            "total_s": float(row[TOTAL]),
+            "mean_ms": float(row[TOTAL]/row[COUNT]*1000),
+            "p50_ms": percentile(row[3:], .5),
+            "p95_ms": percentile(row[3:], .95),
+            "max_ms": float(row[MAX]*1000),
+        } for stage, camera, row in self.__cells(names)]
+
+    def stage_totals(self):
+        """(stage, count, mean ms, p95 ms) of every stage that ran, all cameras together"""
+        totals = []
+        if not self.enabled:
+            return totals
+        for stage in STAGES:
+            rows = self.table[:, STAGE_INDEX[stage]]
+            count = rows[:, COUNT].sum()
+            if count > 0:
+                totals.append((stage, int(count), float(rows[:, TOTAL].sum()/count*1000), percentile(rows[:, 3:].sum(axis=0), .95)))
+        return totals
+
+    def save(self, folder, names=None, info=None):
+        """Writes profile.json (machine, `info`, summary and histograms) and profile.csv (the summary) to `folder`"""
+        if not self.enabled:
+            return None
+        os.makedirs(folder, exist_ok=True)
+        rows = self.summary(names)
+        histograms = {f"{stage}/{camera}": row[3:].astype(int).tolist() for stage, camera, row in self.__cells(names)}
+        profile = {
+            "machine": machine_info(),
+            "info": info or {},
+            "bucket_edges_us": [2**k for k in range(BUCKETS)],
+            "stages": rows,
+            "histograms": histograms,
+        }
+        path = os.path.join(folder, 'profile.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(profile, f, indent=1)
+        with open(os.path.join(folder, 'profile.csv'), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if len(rows) > 0 else ['stage'])
+            writer.writeheader()
+            writer.writerows(rows)
+        return path
+
+## shared by everything that isn't profiled
+DISABLED = StageProfiler(0, enabled=False)
+
+def percentile(buckets, q):
+    """Milliseconds at quantile q of a log2 histogram (middle of the bucket it falls in)"""
+    total = buckets.sum()
+    if total == 0:
+        return 0.
+    k = int(np.searchsorted(np.cumsum(buckets), q*total))
+    return float(1.5*2**min(k, BUCKETS-1)/1000)
+
+def machine_info():
+    return {"platform": platform.platform(), "processor": platform.processor(), "python": platform.python_version(), "cpu_count": os.cpu_count()}
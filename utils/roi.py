@@ -0,0 +1,84 @@
+import os
+import json
+import cv2
+import numpy as np
+
+ROI_NAME = 'rois.json'
+
+def roi_path(session_folder):
+    return os.path.join(session_folder, ROI_NAME)
+
+def video_stem(video_name):
+    return os.path.basename(video_name).split('.')[0]
+
+def has_area(points):
+    """Whether points make a region: two opposite corners of a rectangle or a polygon, with a non-zero area
+    in whole pixels. Anything else would give the model an empty crop."""
+    points = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+    if len(points) < 2:
+        return False
+    if len(points) == 2:
+        return bool((np.abs(points[1]-points[0]) > 0).all())
+    return cv2.contourArea(points) > 0
+
+def valid_rois(rois):
+    """The regions of {video name: points} that have an area, the others are dropped with a message"""
+    for name in [name for name, points in rois.items() if not has_area(points)]:
+        print(f"Ignoring the region of {name}, it has no area")
+    return {name: points for name, points in rois.items() if has_area(points)}
+
+def load_rois(path):
+    """{video name without extension: [[x, y], ...]} of a session, empty if it has none"""
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return valid_rois(json.load(f))
+
+def save_rois(path, rois):
+    tmp = path+'.part'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(rois, f, indent=1)
+    os.replace(tmp, path)
+
+class Roi:
+    """Region of a camera the model looks at: a polygon in frame pixels, or a rectangle given by two
+    opposite corners. Frames are cropped to its bounding box and, for a polygon, blanked outside of it;
+    boxes found in the crop are moved back by `offset`. Raises ValueError when nothing of it is in the frame."""
+    def __init__(self, points, shape):
+        points = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+        if len(points) == 2:
+            (x1, y1), (x2, y2) = points.min(axis=0), points.max(axis=0)
+            points = np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], dtype=np.int32)
+        points[:, 0] = np.clip(points[:, 0], 0, shape[1])
+        points[:, 1] = np.clip(points[:, 1], 0, shape[0])
+        x1, y1 = points.min(axis=0)
+        x2, y2 = points.max(axis=0)
+        if x2 <= x1 or y2 <= y1:
+            raise ValueError(f"The region {points.tolist()} has no area in a frame of {shape[1]}x{shape[0]}")
+        self.box = (int(x1), int(y1), int(x2), int(y2))
+        self.offset = (int(x1), int(y1))
+        self.mask = None
+        if not self.is_rectangle(points):
+            self.mask = np.zeros((y2-y1, x2-x1), dtype=np.uint8)
+            cv2.fillPoly(self.mask, [points-np.array(self.offset, dtype=np.int32)], 255)
+
+    @staticmethod
+    def is_rectangle(points):
+        return len(points) == 4 and len(set(points[:, 0].tolist())) == 2 and len(set(points[:, 1].tolist())) == 2
+
+    def crop(self, frame):
+        x1, y1, x2, y2 = self.box
+        crop = frame[y1:y2, x1:x2]
+        if self.mask is not None:
+            return cv2.bitwise_and(crop, crop, mask=self.mask)
+        return np.ascontiguousarray(crop)
+
+def frame_roi(points, shape):
+    """Roi of the points in a frame of `shape`, None (the whole frame) without points or area"""
+    if points is None or not has_area(points):
+        return None
+    try:
+        return Roi(points, shape)
+    except ValueError as e:
+        print(f"Using the whole frame: {e}")
+        return None
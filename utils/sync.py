@@ -0,0 +1,64 @@
+import os
+import hashlib
+import numpy as np
+from utils.video import load_timestamps, load_index, video_fps
+
+SYNC_MODES = ('index', 'timestamps', 'fps')
+
+def parse_sync(text, videos):
+    """(mode, offset of each video in seconds) from 'index', 'timestamps' or 'fps', optionally followed by
+    offsets: one for all cameras or per camera by file name without extension, e.g. 'timestamps, side=0.4'.
+    A camera that started recording d seconds before the others has an offset of d."""
+    mode = 'index'
+    default = 0.
+    named = {}
+    for item in str(text).replace(' ', '').split(','):
+        if item == '':
+            continue
+        if item.lower() in SYNC_MODES:
+            mode = item.lower()
+            continue
+        name, _, value = item.rpartition('=')
+        if name:
+            named[name] = float(value)
+        else:
+            default = float(value)
+    return mode, [named.get(os.path.basename(video).split('.')[0], default) for video in videos]
+
+def frame_times(video_name, mode):
+    """Time of every frame of a video in seconds: from the container, or frame index over the nominal FPS"""
+    if mode == 'timestamps':
+        return np.asarray(load_timestamps(video_name), dtype=np.float64)
+    return np.arange(load_index(video_name)[0])/video_fps(video_name)
+
+def nearest_frames(times, clock):
+    """Index of the frame of `times` (sorted) closest to each time of `clock`"""
+    right = np.clip(np.searchsorted(times, clock), 1, max(1, len(times)-1))
+    left = right-1
+    return np.where(np.abs(times[left]-clock) <= np.abs(times[np.minimum(right, len(times)-1)]-clock), left, np.minimum(right, len(times)-1))
+
+def session_sync(videos, mode='index', offsets=None):
+    """Frame of each video shown at each step of the session timeline, or None with mode 'index' (frame N of
+    every camera belongs together, as before).
+
+    With 'timestamps' (container presentation times, which accounts for dropped frames and variable frame
+    rates) or 'fps' (constant frame rate), frame times are moved by the camera's offset and the timeline
+    follows the frames of the camera with the lowest frame rate over the span all cameras recorded. Every
+    other camera shows its frame closest to each step: frames in between are skipped, so no camera decodes
+    a frame that's never shown."""
+    if mode == 'index':
+        return None
+    offsets = offsets if offsets is not None else [0.]*len(videos)
+    times = [frame_times(video, mode)-offset for video, offset in zip(videos, offsets)]
+    times = [t if len(t) > 0 else np.zeros(1) for t in times]
+    start = max([t[0] for t in times])
+    end = min([t[-1] for t in times])
+    reference = min(range(len(videos)), key=lambda i: len(times[i])/max(1e-9, times[i][-1]-times[i][0]))
+    clock = times[reference][(times[reference] >= start-1e-6) & (times[reference] <= end+1e-6)]
+    return [nearest_frames(t, clock) for t in times]
+
+def sync_setting(mapping):
+    """What goes into the track key of a camera for its part of the timeline"""
+    if mapping is None:
+        return None
+    return hashlib.sha1(np.asarray(mapping, dtype=np.int64).tobytes()).hexdigest()[:16]
@@ -0,0 +1,80 @@
+import os
+import time
+import cv2
+import numpy as np
+
+BACKGROUND = 90     # gray level of the synthetic scenes, animals are drawn in saturated colors over it
+
+def animal_boxes(count, size, frames, seed=0):
+    """(frames, count, 4) xyxy boxes of `count` rectangles moving at constant speed and bouncing on the
+    edges of a (w, h) scene; the same seed always gives the same motion"""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    dims = rng.uniform(.05, .12, (count, 2))*np.array([w, h])
+    position = rng.uniform(0, 1, (count, 2))*(np.array([w, h])-dims)
+    velocity = rng.uniform(-.01, .01, (count, 2))*np.array([w, h])
+    boxes = np.zeros((frames, count, 4), dtype=np.float32)
+    for cnt in range(frames):
+        boxes[cnt, :, :2] = position
+        boxes[cnt, :, 2:] = position+dims
+        position = position+velocity
+        out = (position < 0) | (position+dims > np.array([w, h]))
+        velocity[out] *= -1
+        position = np.clip(position, 0, np.array([w, h])-dims)
+    return boxes
+
+def write_video(path, boxes, size, fps=30, seed=0):
+    """Draws `boxes` (see animal_boxes) as solid rectangles of fixed colors on a plain background"""
+    rng = np.random.default_rng(seed)
+    colors = [tuple(int(c) for c in color) for color in rng.integers(0, 256, (boxes.shape[1], 3))]
+    colors = [(255, c[1], c[2]) if max(c)-min(c) < 100 else c for c in colors]   # far enough from the gray
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    frame = np.full((size[1], size[0], 3), BACKGROUND, dtype=np.uint8)
+    for frame_boxes in boxes:
+        frame[:] = BACKGROUND
+        for (x1, y1, x2, y2), color in zip(frame_boxes.astype(int), colors):
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color, -1)
+        writer.write(frame)
+    writer.release()
+
+def make_session(folder, cameras=4, frames=300, size=(1280, 720), animals=5, fps=30, seed=0):
+    """Writes a synthetic recording session (one mp4 per camera, camera_0.mp4, ...) to `folder` and returns the
+    video paths. Videos already there with the same settings are kept."""
+    os.makedirs(folder, exist_ok=True)
+    videos = []
+    for camera in range(cameras):
+        path = os.path.join(folder, f'camera_{camera}_{frames}f_{size[0]}x{size[1]}_{animals}a_s{seed}.mp4')
+        if not os.path.isfile(path):
+            write_video(path, animal_boxes(animals, size, frames, seed*1000+camera), size, fps, seed*1000+camera)
+        videos.append(path)
+    return videos
+
+class StubResult:
+    """Enough of an ultralytics Results for update_tracker: boxes and to()"""
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+    def to(self, device):
+        return self
+
+class StubDetector:
+    """Deterministic stand-in for a YOLO model on synthetic scenes: boxes are the connected regions that differ
+    from the background, found in a few OpenCV calls. `latency_ms` per frame is added to emulate inference.
+    Has the predict() used by track_session and choose_imgsz; needs ultralytics for its Boxes."""
+    def __init__(self, latency_ms=0, min_area=64):
+        self.latency = latency_ms/1000
+        self.min_area = min_area
+
+    def detect(self, frame, conf=0.2):
+        """(n, 6) xyxy, confidence, class of the regions of a BGR frame"""
+        mask = (np.abs(frame.astype(np.int16)-BACKGROUND).max(axis=2) > 30).astype(np.uint8)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=4)
+        data = [[x, y, x+w, y+h, .9, 0] for x, y, w, h, area in stats[1:count] if area >= self.min_area]
+        return np.asarray(data, dtype=np.float32).reshape(-1, 6)
+
+    def predict(self, frames, conf=0.2, **kwargs):
+        from ultralytics.engine.results import Boxes
+        frames = frames if isinstance(frames, list) else [frames]
+        if self.latency > 0:
+            time.sleep(self.latency*len(frames))
+        return [StubResult(Boxes(self.detect(frame, conf), frame.shape[:2])) for frame in frames]
@@ -0,0 +1,147 @@
+import os
+import glob
+import json
+import hashlib
+import numpy as np
+
+class TrackRecorder:
+    """Collects the per-frame boxes of one video and writes them as a columnar .npz file"""
+    def __init__(self):
+        self.frames = []
+        self.xywh = []
+        self.conf = []
+        self.cls = []
+        self.ids = []
+        self.length = 0
+
+    def add(self, cnt, boxes, track_ids, confs, classes):
+        self.length = max(self.length, cnt+1)
+        for box, track_id, c, k in zip(boxes, track_ids, confs, classes):
+            self.frames.append(cnt)
+            self.xywh.append(box)
+            self.conf.append(c)
+            self.cls.append(k)
+            self.ids.append(track_id)
+
+    def arrays(self):
+        return dict(frame=np.asarray(self.frames, dtype=np.int32),
+                    xywh=np.asarray(self.xywh, dtype=np.float32).reshape(-1, 4),
+                    conf=np.asarray(self.conf, dtype=np.float32),
+                    cls=np.asarray(self.cls, dtype=np.int16),
+                    id=np.asarray(self.ids, dtype=np.int32),
+                    length=np.int32(self.length))
+
+    def save(self, path, meta=None):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # write next to the target first so an interrupted save never looks like a complete store
+        tmp = path+'.part'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, meta=json.dumps(meta or {}), **self.arrays())
+        os.replace(tmp, path)
+
+class TrackReader:
+    """Random access to the boxes of a video written by TrackRecorder.
+    `source` is either the path of a saved file or TrackRecorder.arrays()"""
+    def __init__(self, source):
+        data = np.load(source) if isinstance(source, str) else source
+        order = np.argsort(data['frame'], kind='stable')
+        self.frame = data['frame'][order]
+        self.xywh = data['xywh'][order]
+        self.conf = data['conf'][order]
+        self.cls = data['cls'][order]
+        self.id = data['id'][order]
+        self.length = int(data['length'])
+
+    def __len__(self):
+        return self.length
+
+    def get(self, cnt):
+        """Returns (boxes, track_ids, confs, classes) of frame `cnt`"""
+        start = np.searchsorted(self.frame, cnt, side='left')
+        end = np.searchsorted(self.frame, cnt, side='right')
+        return self.xywh[start:end].tolist(), self.id[start:end].tolist(), self.conf[start:end].tolist(), self.cls[start:end].tolist()
+
+    def window(self, start, end):
+        """(frame, xywh, id) arrays of the boxes in frames [start, end)"""
+        s, e = np.searchsorted(self.frame, start), np.searchsorted(self.frame, end)
+        return self.frame[s:e], self.xywh[s:e], self.id[s:e]
+
+    def ids(self, start, end):
+        """Track ids seen in frames [start, end)"""
+        return np.unique(self.id[np.searchsorted(self.frame, start):np.searchsorted(self.frame, end)]).tolist()
+
+def pack_window(rows):
+    """(frame, xywh, id) arrays from a list of (cnt, boxes, track_ids), the same layout as TrackReader.window"""
+    frames = [cnt for cnt, boxes, _ in rows for _ in boxes]
+    xywh = [box for _, boxes, _ in rows for box in boxes]
+    ids = [track_id for _, _, track_ids in rows for track_id in track_ids]
+    return np.asarray(frames, dtype=np.int32), np.asarray(xywh, dtype=np.float32).reshape(-1, 4), np.asarray(ids, dtype=np.int32)
+
+def file_digest(path, sample=None, chunk=1<<20):
+    """sha1 of a file. With `sample`, only that many evenly spread chunks are hashed (with the file size),
+    which is enough to tell recordings apart without reading tens of GB."""
+    h = hashlib.sha1()
+    size = os.path.getsize(path)
+    h.update(str(size).encode())
+    with open(path, 'rb') as f:
+        if sample is None or size <= sample*chunk:
+            for block in iter(lambda: f.read(chunk), b''):
+                h.update(block)
+        else:
+            for i in range(sample):
+                f.seek((size-chunk)*i//(sample-1))
+                h.update(f.read(chunk))
+    return h.hexdigest()
+
+def model_digest(path):
+    """sha1 of a model file, or of every file of an exported model folder (OpenVINO)"""
+    if not os.path.isdir(path):
+        return file_digest(path)
+    h = hashlib.sha1()
+    for root, _, files in sorted(os.walk(path)):
+        for name in sorted(files):
+            h.update(name.encode())
+            h.update(file_digest(os.path.join(root, name)).encode())
+    return h.hexdigest()
+
+def track_key(video_name, weight_name, conf_thresh, iou_thresh, params, **settings):
+    """Identifies the tracks of a video: content of the video and the weights, NMS and tracker parameters
+    and any other setting that changes the boxes (detection stride, sampling interval, image size, ...)"""
+    inputs = {
+        "video": file_digest(video_name, sample=64),
+        "weights": model_digest(weight_name),
+        "conf": float(conf_thresh),
+        "iou": float(iou_thresh),
+        "tracker": params,
+        **{name: value for name, value in settings.items() if value is not None}    # None: not used
+    }
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:16], inputs
+
+def track_file(folder, video_name, key):
+    return os.path.join(folder, os.path.basename(video_name).split('.')[0]+'.'+key+'.npz')
+
+def find_tracks(folders, video_name, key):
+    """Path of the stored tracks of `video_name` under `key` in any of `folders`, or None"""
+    for folder in folders:
+        path = track_file(folder, video_name, key)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def stored_tracks(folder, video_name):
+    """All the stored tracks of a video, whatever their key"""
+    return glob.glob(os.path.join(glob.escape(folder), glob.escape(os.path.basename(video_name).split('.')[0])+'.*.npz'))
+
+def store_folders(session_folder):
+    """Where tracks are looked for: beside the videos first, then the user cache (for read-only recordings)"""
+    return [os.path.join(session_folder, 'tracks'), os.path.join(os.path.expanduser('~'), '.cache', 'semi-autolabeling', 'tracks')]
+
+def writable_folder(folders):
+    for folder in folders:
+        try:
+            os.makedirs(folder, exist_ok=True)
+            if os.access(folder, os.W_OK):
+                return folder
+        except OSError:
+            pass
+    return None
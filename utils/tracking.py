@@ -0,0 +1,363 @@
+import os
+import copy
+import pickle
+import cv2
+import numpy as np
+import torch
+from ultralytics import YOLO
+
+from utils.track_store import TrackReader, TrackRecorder, pack_window
+from utils.video import VideoReader, SyncedReader, frame_shape
+from utils.roi import frame_roi
+from utils.cores import pin_process, RateMeter
+from utils.profiler import DISABLED
+
+def tracker_params(track_high_thresh=0.5, track_low_thresh=0.1, new_track_thresh=0.5, track_buffer=300, match_thresh=0.8):
+    return {
+        "tracker_type": 'bytetrack',
+        "track_high_thresh": float(track_high_thresh),
+        "track_low_thresh": float(track_low_thresh),
+        "new_track_thresh": float(new_track_thresh),
+        "track_buffer": int(track_buffer),
+        "match_thresh": float(match_thresh),
+        "fuse_score": True
+    }
+
+def emit(stream, frame, boxes, track_ids, cnt, running, state=None, window=None):
+    """Queues a sampled frame for review as (RGB frame, boxes, track_ids, cnt, tracker state, window), where
+    window holds the boxes of the frames since the previous sampled frame (see pack_window).
+    `stream` is a SharedFrameRing: the frame is converted straight into one of its slots."""
+    slot = stream.acquire(running)
+    if slot is None:
+        return False
+    cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=stream.frames[slot])
+    stream.publish(slot, boxes, track_ids, cnt, state, window)
+    return True
+
+## auto inference size: candidates, probed frames and the agreement required with the largest size
+AUTO_SIZES = (640, 960, 1280)
+AUTO_FRAMES = 30
+AUTO_TOLERANCE = 0.95
+
+def parse_imgsz(text, videos):
+    """Inference size of each video from '1280', 'auto' or per camera 'top=640, side=auto' (by file name
+    without extension), cameras not named get the plain value, 1280 by default"""
+    default = 1280
+    named = {}
+    for item in str(text).replace(' ', '').split(','):
+        if item == '':
+            continue
+        name, _, value = item.rpartition('=')
+        value = 'auto' if value.lower() == 'auto' else int(value)
+        if name:
+            named[name] = value
+        else:
+            default = value
+    return [named.get(os.path.basename(video).split('.')[0], default) for video in videos]
+
+def imgsz_setting(imgsz):
+    """What goes into the track key for an inference size"""
+    if imgsz == 'auto':
+        return {"auto": list(AUTO_SIZES), "frames": AUTO_FRAMES, "tolerance": AUTO_TOLERANCE}
+    return int(imgsz)
+
+def interval_setting(interval, detect_stride):
+    """What goes into the track key for the sampling interval: with a stride, the sampled frames are forced
+    keyframes, so the boxes depend on it. None when every frame is a keyframe or nothing is sampled."""
+    return int(interval) if interval is not None and detect_stride > 1 else None
+
+def choose_imgsz(model, video_name, conf_thresh, iou_thresh, device, sizes=AUTO_SIZES, frames=AUTO_FRAMES, tolerance=AUTO_TOLERANCE, roi=None):
+    """Smallest inference size whose boxes on the first `frames` frames (cropped to `roi`) agree with the
+    largest size's (recall and precision at least `tolerance`)"""
+    from utils.evaluation import compare_detections
+    cap = VideoReader(video_name)
+    samples = []
+    while len(samples) < frames:
+        success, frame = cap.read()
+        if not success:
+            break
+        samples.append(frame if roi is None else roi.crop(frame))
+    cap.release()
+    if len(samples) == 0:
+        return max(sizes)
+
+    def detect(size):
+        results = model.predict(samples, imgsz=size, conf=conf_thresh, iou=iou_thresh, half=False, device=device, save=False, verbose=False)
+        return [result.boxes.xywh.cpu().numpy() for result in results]
+
+    sizes = sorted(sizes)
+    reference = detect(sizes[-1])
+    for size in sizes[:-1]:
+        report = compare_detections(reference, detect(size))
+        if report["recall"] >= tolerance and report["precision"] >= tolerance:
+            return size
+    return sizes[-1]
+
+def open_reader(video_name, sync=None):
+    """Reader of a video on its own frames, or on the session timeline `sync` (see sync.session_sync)"""
+    return VideoReader(video_name) if sync is None else SyncedReader(video_name, sync)
+
+def replay(video_name, interval, tracks_path, mapping, output_stream, running, video_length, start_frame=0, fps=None, profiler=DISABLED, camera=0, sync=None):
+    """Feeds the review page from tracks computed by a headless run instead of running the model.
+    Only the sampled frames from `start_frame` on are decoded, the reader seeks over the rest.
+    `fps` (shared value) gets the video frames covered per second. Stage times go to `profiler` as `camera`.
+    With `sync`, frames are counted on the session timeline, as the tracks were stored."""
+    ## decoding one frame at a time doesn't need a thread pool, the cores are left to the trackers
+    pin_process(threads=1)
+    meter = RateMeter(fps)
+    tracks = TrackReader(tracks_path)
+    reader = open_reader(video_name, sync)
+
+    video_length.value = min(len(tracks), reader.frame_count)
+    for cnt in range(-(-start_frame//interval)*interval, video_length.value, interval):
+        start = profiler.start()
+        if not running.value or not reader.seek(cnt):
+            break
+        success, frame = reader.read()
+        if not success:
+            break
+        profiler.stop('decode', camera, start)
+
+        for id in tracks.ids(0 if cnt==0 else cnt-interval+1, cnt+1):
+            if id not in mapping:
+                mapping[id] = 0
+        boxes, track_ids, _, _ = tracks.get(cnt)
+        start = profiler.start()
+        emit(output_stream, frame, boxes, track_ids, cnt, running, window=tracks.window(max(0, cnt-interval+1), cnt))
+        profiler.stop('queue_put', camera, start)
+        meter.tick(interval)
+
+    meter.stop()
+    reader.release()
+    output_stream.put(None, running=running)
+
+def create_tracker(params, frame_rate=30):
+    """A ByteTrack state built from in-memory parameters (see tracker_params)"""
+    from ultralytics.trackers.byte_tracker import BYTETracker
+    from ultralytics.utils import IterableSimpleNamespace
+    return BYTETracker(IterableSimpleNamespace(**params), frame_rate=frame_rate)
+
+def dump_tracker(tracker):
+    """Snapshot of a ByteTrack state, with the id counter shared by all the tracks of the process.
+    Removed tracks are left out: they are never matched again and would make every snapshot, sent along each
+    sampled frame, grow with the session. Lost tracks are kept (up to track_buffer), they can still come back."""
+    from ultralytics.trackers.basetrack import BaseTrack
+    state = copy.copy(tracker)
+    state.removed_stracks = []
+    return pickle.dumps((state, BaseTrack._count))
+
+def load_tracker(state):
+    """Tracker of a dump_tracker snapshot; it is unpickled, so `state` must come from a trusted checkpoint"""
+    from ultralytics.trackers.basetrack import BaseTrack
+    tracker, count = pickle.loads(state)
+    BaseTrack._count = max(BaseTrack._count, count)
+    return tracker
+
+def update_tracker(tracker, results, frame, offset=None):
+    """Feeds the detections of one frame to a ByteTrack state.
+    `offset`: (x, y) of the crop the detections were made on, they are moved back to frame coordinates.
+    Returns the tracked boxes as (xywh, track_ids, confs, classes)"""
+    det = results.boxes.cpu().numpy()
+    if offset is not None:
+        from ultralytics.engine.results import Boxes
+        data = det.data.copy()
+        data[:, :4] += np.array(offset*2, dtype=data.dtype)
+        det = Boxes(data, frame.shape[:2])
+    tracks = tracker.update(det, frame)
+    if len(tracks) == 0:
+        return [], [], [], []
+    tracks = np.asarray(tracks)
+    xyxy = tracks[:, :4]
+    xywh = np.concatenate(((xyxy[:, :2]+xyxy[:, 2:])/2, xyxy[:, 2:]-xyxy[:, :2]), axis=1)
+    return xywh.tolist(), tracks[:, 4].astype(int).tolist(), tracks[:, 5].tolist(), tracks[:, 6].astype(int).tolist()
+
+def predict_tracker(tracker):
+    """Carries the tracks of a ByteTrack state one frame forward with its Kalman filter, without detection.
+    Returns the predicted boxes as (xywh, track_ids, confs, classes)"""
+    tracker.multi_predict(tracker.tracked_stracks+tracker.lost_stracks)
+    boxes, track_ids, confs, classes = [], [], [], []
+    for t in tracker.tracked_stracks:
+        if not t.is_activated:
+            continue
+        x, y, w, h = t.tlwh
+        boxes.append([float(x+w/2), float(y+h/2), float(w), float(h)])
+        track_ids.append(int(t.track_id))
+        confs.append(float(t.score))
+        classes.append(int(t.cls))
+    return boxes, track_ids, confs, classes
+
+def track_session(videos, interval, weight_name, conf_thresh, iou_thresh, params, mappings, output_streams, running, video_length, recorders=None, detect_stride=1, max_frames=None, overlay=None, store_paths=None, store_meta=None, start_frame=0, tracker_states=None, imgsz=1280, rois=None, cores=None, fps=None, profiler=DISABLED, camera_ids=None, model=None, sync=None):
+    """Tracks all the cameras of a session with a single model.
+    Frame N of every camera goes through the model as one batch, then the detections of each
+    camera are sent to its own ByteTrack state.
+
+    With `detect_stride` > 1 detection only runs on every detect_stride-th frame and on the sampled
+    frames (cnt%interval==0). In between, frames are only grabbed, not decoded, and the tracks are
+    carried forward by the Kalman prediction of ByteTrack. `interval` None: no frame is sampled (headless
+    runs), the stride alone decides.
+
+    With an `overlay` (OverlayExporter) the boxes of every frame go to its encoder process, which decodes
+    the frames itself.
+
+    With `store_paths`, the boxes of each camera tracked to its last frame are saved there (see TrackRecorder),
+    so a later session with the same inputs replays them instead of running the model.
+
+    A session checkpoint resumes with `start_frame` and the `tracker_states` sent along its sampled frames:
+    the readers seek straight to start_frame and the ByteTrack states (and so the track ids) carry on.
+    Resumed sessions are not stored since they don't cover the whole video.
+
+    `imgsz` is the inference size of all cameras or a list with one per camera; cameras of the same size
+    share a batch. 'auto' picks the size of that camera with choose_imgsz.
+
+    `rois`: polygon (or two corners of a rectangle) of each camera, None for the whole frame. The model
+    only sees the crop of the region, boxes are moved back to frame coordinates.
+
+    `cores`: CPU cores the process is kept on, torch and OpenCV use as many threads (see pin_process).
+    `fps`: shared value of each camera that gets its frames tracked per second, 0 once it's done.
+
+    Stage times (decode, inference, tracking, queue_put) go to `profiler` under the camera numbers `camera_ids`
+    (default 0..n-1). The time of a detection batch is shared out among its cameras.
+
+    `model`: object with the predict() of a YOLO model used instead of loading `weight_name`
+    (e.g. synthetic.StubDetector for benchmarks).
+
+    `sync`: frame of each camera at each step of the session timeline (see sync.session_sync), None to go
+    by frame index. Frame numbers (sampled frames, stored tracks, checkpoints) then count timeline steps;
+    frames a camera skips are only grabbed."""
+    pin_process(cores)
+    meters = [RateMeter(fps[i] if fps is not None else None) for i in range(len(videos))]
+    camera_ids = camera_ids if camera_ids is not None else list(range(len(videos)))
+    model = model if model is not None else YOLO(weight_name)
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    rois = [frame_roi(points, frame_shape(video)) for video, points in zip(videos, rois)] if rois is not None else [None]*len(videos)
+    sizes = list(imgsz) if isinstance(imgsz, (list, tuple)) else [imgsz]*len(videos)
+    for i, size in enumerate(sizes):
+        if size == 'auto':
+            sizes[i] = choose_imgsz(model, videos[i], conf_thresh, iou_thresh, device, roi=rois[i])
+            print(f"{videos[i]}: inference size {sizes[i]}")
+    caps = [open_reader(video, sync[i] if sync is not None else None) for i, video in enumerate(videos)]
+    # track_buffer is given in frames while ByteTrack counts updates, i.e. keyframes
+    trackers = [create_tracker(params, frame_rate=30/detect_stride) for _ in videos]
+    active = [True]*len(videos)
+    if start_frame > 0:
+        store_paths = None
+        for i, cap in enumerate(caps):
+            if tracker_states is not None and tracker_states[i] is not None:
+                trackers[i] = load_tracker(tracker_states[i])
+            if not cap.seek(start_frame):
+                active[i] = False
+                if output_streams is not None:
+                    output_streams[i].put(None, running=running)
+    if store_paths is not None and recorders is None:
+        recorders = [TrackRecorder() for _ in videos]
+    windows = [[] for _ in videos]
+
+    ## several tracker processes may share it
+    video_length.value = max([cap.frame_count for cap in caps]+[video_length.value])
+    cnt = start_frame-1
+    while any(active) and running.value:
+        cnt+=1
+        if max_frames is not None and cnt >= max_frames:
+            break
+        keyframe = cnt%detect_stride==0 or (interval is not None and cnt%interval==0)
+        frames = []
+        cameras = []
+        for i, cap in enumerate(caps):
+            if not active[i]:
+                continue
+            start = profiler.start()
+            if keyframe:
+                success, frame = cap.read()
+            else:
+                success, frame = cap.grab(), None
+            profiler.stop('decode', camera_ids[i], start)
+            if not success:
+                active[i] = False
+                meters[i].stop()
+                if output_streams is not None:
+                    output_streams[i].put(None, running=running)
+                continue
+            frames.append(frame)
+            cameras.append(i)
+        if len(frames) == 0:
+            break
+
+        results_ = [None]*len(frames)
+        if keyframe:
+            # Run detection on the frames of all cameras at once, one batch per inference size
+            for size in sorted(set([sizes[i] for i in cameras])):
+                group = [k for k, i in enumerate(cameras) if sizes[i] == size]
+                start = profiler.start()
+                results = model.predict(
+                    [frames[k] if rois[cameras[k]] is None else rois[cameras[k]].crop(frames[k]) for k in group],
+                    imgsz=size,
+                    conf=conf_thresh,
+                    iou=iou_thresh,
+                    half=False,
+                    device=device,
+                    save=False,
+                    verbose=False,
+                )
+                for k, result in zip(group, results):
+                    results_[k] = result
+                if profiler.enabled:
+                    elapsed = (profiler.start()-start)/len(group)
+                    for k in group:
+                        profiler.add('inference', camera_ids[cameras[k]], elapsed)
+
+        for i, frame, results in zip(cameras, frames, results_):
+            start = profiler.start()
+            if results is not None:
+                boxes, track_ids, confs, classes = update_tracker(trackers[i], results.to('cpu'), frame, rois[i].offset if rois[i] is not None else None)
+            else:
+                boxes, track_ids, confs, classes = predict_tracker(trackers[i])
+            profiler.stop('tracking', camera_ids[i], start)
+            if overlay is not None:
+                overlay.submit(i, boxes, track_ids, cnt)
+            if recorders is not None:
+                recorders[i].add(cnt, boxes, track_ids, confs, classes)
+            meters[i].tick()
+
+            for id in track_ids:
+                if id not in mappings[i]:
+                    mappings[i][id] = 0
+
+            if output_streams is not None:
+                if cnt%interval==0:
+                    start = profiler.start()
+                    emit(output_streams[i], frame, boxes, track_ids, cnt, running, dump_tracker(trackers[i]), pack_window(windows[i]))
+                    profiler.stop('queue_put', camera_ids[i], start)
+                    windows[i] = []
+                elif len(track_ids) > 0:
+                    windows[i].append((cnt, boxes, track_ids))
+
+    for i, cap in enumerate(caps):
+        cap.release()
+        meters[i].stop()
+        if active[i] and output_streams is not None:
+            output_streams[i].put(None, running=running)
+        # only complete tracks are stored
+        if store_paths is not None and store_paths[i] is not None and not active[i] and running.value:
+            recorders[i].save(store_paths[i], store_meta[i] if store_meta is not None else None)
+
+def evaluate_stride(videos, weight_name, conf_thresh, iou_thresh, params, strides, max_frames=3000, imgsz=1280):
+    """Measures what strided detection costs in ID consistency against per-frame detection,
+    on the first `max_frames` frames of every video. Returns {stride: [metrics per video]}"""
+    from utils.evaluation import compare_tracks
+
+    def run(stride):
+        recorders = [TrackRecorder() for _ in videos]
+        track_session(videos, max_frames, weight_name, conf_thresh, iou_thresh, params, [dict() for _ in videos], None, _Flag(True), _Flag(0), recorders=recorders, detect_stride=stride, max_frames=max_frames, imgsz=imgsz)
+        return [TrackReader(recorder.arrays()) for recorder in recorders]
+
+    reference = run(1)
+    report = {}
+    for stride in strides:
+        candidate = run(stride)
+        report[stride] = [compare_tracks(ref, cand) for ref, cand in zip(reference, candidate)]
+    return report
+
+class _Flag:
+    """Stands in for a multiprocessing.Value when nothing else reads it"""
+    def __init__(self, value):
+        self.value = value
@@ -1,9 +1,48 @@
 import pygame
 import cv2
 import numpy as np
+from collections import OrderedDict
 
 display_w = pygame.display.Info().current_w
 
+## fonts and rendered texts are shared by all widgets, most texts are the same from one loop to the next
+FONTS = {}
+TEXT_CACHE = OrderedDict()
+TEXT_CACHE_SIZE = 4096
+
+def get_font(size):
+    size = int(size)
+    if size not in FONTS:
+        FONTS[size] = pygame.font.Font(None, size)
+    return FONTS[size]
+
+def fit_text(font, text, width):
+    """`text` if it fits in `width`, otherwise its longest tail that fits in width-10 behind '...'.
+    The tail is found by bisection, measuring O(log n) candidates instead of one per character."""
+    if font.size(text)[0] <= width:
+        return text
+    low, high = 0, len(text)    # number of characters kept
+    while low < high:
+        mid = (low+high+1)//2
+        if font.size('...'+text[len(text)-mid:])[0] < width-10:
+            low = mid
+        else:
+            high = mid-1
+    return '...'+text[len(text)-low:]
+
+def render_text(font, text, color, width=None):
+    """Cached font.render; with `width`, overflowing text is cut from the left (see fit_text)"""
+    key = (font, text, color if isinstance(color, str) else tuple(color), width)
+    surface = TEXT_CACHE.get(key)
+    if surface is None:
+        surface = font.render(text if width is None else fit_text(font, text, width), True, color)
+        TEXT_CACHE[key] = surface
+        if len(TEXT_CACHE) > TEXT_CACHE_SIZE:
+            TEXT_CACHE.popitem(last=False)
+    else:
+        TEXT_CACHE.move_to_end(key)
+    return surface
+
 class ImageRect:
     def __init__(self,base_image_path,hover_image_path,select_image_path,width,height,pos):
         
@@ -35,8 +74,31 @@ class ImageRect:
     def get_rect(self):
         return [self.pos[0], self.pos[1], self.width, self.height]
 
+class FrameTile:
+    """Display surface of an RGB frame scaled to a grid tile. It's rebuilt only when another frame is shown
+    or the tile size changes, not on every loop."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.frame = None
+        self.size = None
+        self.surface = None
+
+    def get(self, frame, size):
+        size = (int(size[0]), int(size[1]))
+        if frame is not self.frame or size != self.size:
+            scaled = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            self.surface = pygame.image.frombuffer(scaled.tobytes(), size, "RGB").convert()
+            self.frame = frame
+            self.size = size
+        return self.surface
+
 class ClickableArea:
-    def __init__(self,x,y,w,h,rectangles,mapping,ids, colors, func=None, **args):
+    """Boxes with their names drawn over a frame shown at any size (x, y, w, h and the rectangles are in frame
+    pixels). The overlay is drawn at the size it's shown at and kept until the names, colors or the size
+    change; clicks are looked up in a grid of cells instead of testing every box."""
+    def __init__(self,x,y,w,h,rectangles,mapping,ids, colors, func=None, cells=8, **args):
         self.x = x
         self.y = y
         self.w = w
@@ -47,63 +109,65 @@ class ClickableArea:
         self.colors = colors
         self.func = func
         self.args = args
+        self.font = get_font(0.014*display_w)
+
+        ## boxes of every cell they overlap
+        self.cell_w, self.cell_h = max(1, w/cells), max(1, h/cells)
+        self.cells = {}
+        for i, rect in enumerate(self.rectangles):
+            for cx in range(max(0, int(rect.left//self.cell_w)), min(cells-1, int(rect.right//self.cell_w))+1):
+                for cy in range(max(0, int(rect.top//self.cell_h)), min(cells-1, int(rect.bottom//self.cell_h))+1):
+                    self.cells.setdefault((cx, cy), []).append(i)
 
         self.update()
 
     def update(self):
-        # Create the virtual surface (fixed size)
-        self.virtual_surface = pygame.Surface((self.w, self.h),pygame.SRCALPHA)
-        self.virtual_surface.fill((0, 0, 0, 0)) 
+        """Call after changing mapping or colors"""
+        self.surface = None
 
-        # Load font for drawing text
-        self.font = pygame.font.Font(None,int(0.014*display_w))  # Default font
-        
-        # Draw rectangles and text onto the virtual surface
+    def __render(self, target_w, target_h):
+        self.surface = pygame.Surface((target_w, target_h), pygame.SRCALPHA)
+        sx, sy = target_w/self.w, target_h/self.h
         for i, rect in enumerate(self.rectangles):
-            pygame.draw.rect(self.virtual_surface, self.colors[self.ids[i]], rect, 5)  # Draw rectangle
-            # Create title text
-            title_text = self.font.render(str(self.mapping[self.ids[i]]), True, (255, 255, 255))
-            
-            # Get text dimensions and position it above the rectangle
+            rect = pygame.Rect(rect.x*sx, rect.y*sy, rect.w*sx, rect.h*sy)
+            pygame.draw.rect(self.surface, self.colors[self.ids[i]], rect, 2)
+            # title text above the rectangle, on a dark background
+            title_text = render_text(self.font, str(self.mapping[self.ids[i]]), (255, 255, 255))
             text_rect = title_text.get_rect(center=rect.center)
-            text_rect.y -= rect.height // 2 + 5  # Position text above the rectangle
-            
-            # Draw the background for the text (with padding)
-            bg_rect = pygame.Rect(text_rect.x - 5, text_rect.y - 5, 
-                                  title_text.get_width() + 2 * 5, 
-                                  title_text.get_height() + 2 * 5)
-            pygame.draw.rect(self.virtual_surface, (50,50,50), bg_rect)  # Background behind the text
-            
-            # Blit the text over the background
-            self.virtual_surface.blit(title_text, text_rect)
-
-    def draw(self, screen, target_x, target_y, target_w, target_h):     
-        # Scale the virtual surface to target size
-        scaled_surface = pygame.transform.smoothscale(self.virtual_surface, (target_w, target_h))
-        # scaled_surface = self.virtual_surface
-
-        # Blit the scaled surface to the screen at the target position
-        screen.blit(scaled_surface, (target_x, target_y))
+            text_rect.y -= rect.height // 2 + 5
+            bg_rect = pygame.Rect(text_rect.x - 3, text_rect.y - 3, title_text.get_width() + 2 * 3, title_text.get_height() + 2 * 3)
+            pygame.draw.rect(self.surface, (50,50,50), bg_rect)
+            self.surface.blit(title_text, text_rect)
+
+    def draw(self, screen, target_x, target_y, target_w, target_h):
+        target_w, target_h = int(target_w), int(target_h)
+        if self.surface is None or self.surface.get_size() != (target_w, target_h):
+            self.__render(target_w, target_h)
+        screen.blit(self.surface, (target_x, target_y))
         if self.func != None:
             self.handle_click(target_x, target_y, target_w, target_h)
-    
+
+    def hit(self, rel_x, rel_y):
+        """Index of the smallest box under a point in frame pixels, or None"""
+        candidates = self.cells.get((int(rel_x//self.cell_w), int(rel_y//self.cell_h)), [])
+        hits = [i for i in candidates if self.rectangles[i].collidepoint(rel_x, rel_y)]
+        if len(hits) == 0:
+            return None
+        return min(hits, key=lambda i: self.rectangles[i].w*self.rectangles[i].h)
+
     def handle_click(self,target_x, target_y, target_w, target_h):
-        """Returns the index of the clicked rectangle, or None if no hit"""
         mx, my =  pygame.mouse.get_pos()
         # Check if the click is inside the drawn area
         if not (target_x <= mx <= target_x + target_w and
                 target_y <= my <= target_y + target_h):
             return
+        if not pygame.mouse.get_pressed()[0]:
+            return
 
-        # Convert to virtual coordinates
-        rel_x = (mx - target_x) * self.w / target_w
-        rel_y = (my - target_y) * self.h / target_h
-
-        # Check collision with rectangles
-        for i, rect in enumerate(self.rectangles):
-            if rect.collidepoint(rel_x, rel_y):
-                if pygame.mouse.get_pressed()[0]:
-                    self.func(item=self.ids[i], **self.args)
+        # Convert to frame coordinates
+        i = self.hit((mx - target_x) * self.w / target_w, (my - target_y) * self.h / target_h)
+        if i is not None:
+            self.func(item=self.ids[i], **self.args)
 
 class ImageButton:
     def __init__(self,image, hover_image ,width,height,pos,func, clickable=True, **args):
@@ -162,7 +226,7 @@ class Button:
         self.disable_color = '#798483'
 
         #text
-        self.text_surf = pygame.font.Font(None,int(0.018*display_w)).render(text,True,'#ffffff')
+        self.text_surf = render_text(get_font(0.018*display_w), text, '#ffffff')
         self.text_rect = self.text_surf.get_rect(center = self.top_rect.center)
 
         # function
@@ -171,7 +235,7 @@ class Button:
 
     def update_text(self, text):
         #text
-        self.text_surf = pygame.font.Font(None,int(0.018*display_w)).render(text,True,'#ffffff')
+        self.text_surf = render_text(get_font(0.018*display_w), text, '#ffffff')
         self.text_rect = self.text_surf.get_rect(center = self.top_rect.center)
 
     def update(self):
@@ -255,8 +319,8 @@ class Checkbox(pygame.sprite.Sprite):
         self.surface = surface
         # self.image = pygame.Surface([300,50])#, pygame.SRCALPHA, 32)
         self.caption = caption
-        self.font = pygame.font.Font(None, int(0.014*display_w))
-        rect = self.font.render(self.caption, True, (0,0,0))
+        self.font = get_font(0.014*display_w)
+        rect = render_text(self.font, self.caption, (0,0,0))
         self.image = pygame.Surface([(0.023 * display_w + rect.get_rect().width), 0.019*display_w])
         # self.image = self.image.convert_alpha()
         self.image.fill((255,255,255))
@@ -278,7 +342,7 @@ class Checkbox(pygame.sprite.Sprite):
         self.args = args
 
     def _draw_button_text(self):
-        font_surf = self.font.render(self.caption, True, (0, 0, 0) if self.enable else (100,100,100))
+        font_surf = render_text(self.font, self.caption, (0, 0, 0) if self.enable else (100,100,100))
         w, h = self.font.size(self.caption)
         font_pos = (int(0.015*display_w) + 10, int(0.015*display_w) / 2 - h / 2)
         self.image.blit(font_surf, font_pos)
@@ -325,7 +389,7 @@ class Checkbox(pygame.sprite.Sprite):
             
 class InputBox:
     def __init__(self, x, y, w, h, func=None, enable=True, text='', fontSize=None, **args):
-        self.FONT = pygame.font.Font(None, fontSize if fontSize is not None else int(0.018*display_w))
+        self.FONT = get_font(fontSize if fontSize is not None else 0.018*display_w)
         self.x = x
         self.y = y
         self.rect = pygame.Rect(x, y, w, h)
@@ -383,7 +447,7 @@ class InputBox:
                 text+='|'
             self.cursor_blink = (self.cursor_blink+1)%self.cursor_blink_interval
         pygame.draw.rect(screen, (230,230,230,230) if self.enable else (240,240,240,240), self.rect ,border_radius = 6)
-        t = self.FONT.render(text, True, self.color if self.enable else (100,100,100))
+        t = render_text(self.FONT, text, self.color if self.enable else (100,100,100))
         screen.blit(t, (self.rect.x+10, self.rect.y+(self.rect.height - t.get_rect().height)//2))
         # Blit the rect.
         # pygame.draw.rect(screen, self.color, self.rect, 2)
@@ -392,7 +456,7 @@ class InputBox:
    
 class Label:
     def __init__(self, x, y, w=display_w-200, text='', color=(0,0,0), pos='left'):
-        self.FONT = pygame.font.Font(None, int(0.014*display_w))
+        self.FONT = get_font(0.014*display_w)
         self.x = x
         self.y = y
         self.w = w
@@ -402,46 +466,27 @@ class Label:
         self.pos = pos
 
     def get_width(self):
-        w = self.FONT.render(self.text, True, (0,0,0)).get_rect().width if isinstance(self.text, str) else 0
+        w = self.FONT.size(self.text)[0] if isinstance(self.text, str) else 0
         return w
         
     def draw(self, screen, events=None):
         # Blit the text.
         y = self.y+5
         if isinstance(self.text, str):
-            for line in self.text.split('\n'):
-                text = self.FONT.render(line, True, self.color)
-                if text.get_rect().width > self.w:
-                    new_text = ''
-                    while self.FONT.render(new_text, True, self.color).get_rect().width < self.w-10:
-                        new_text = line[-1]+new_text
-                        line=line[:-1]
-                    new_text = '...'+new_text
-                    text = self.FONT.render(new_text, True, self.color)
-
-                if self.pos=='left':
-                    screen.blit(text, (self.x+5, y))
-                elif self.pos =='center':
-                    screen.blit(text, (self.x+(self.w-text.get_rect().width)//2, y))
-                h = text.get_rect().height
-                y += h+10
+            lines = self.text.split('\n')
         elif isinstance(self.text, list):
-            for line in self.text:
-                text = self.FONT.render(line, True, self.color)
-                if text.get_rect().width > self.w:
-                    new_text = ''
-                    while self.FONT.render(new_text, True, self.color).get_rect().width < self.w-10:
-                        new_text = line[-1]+new_text
-                        line=line[:-1]
-                    new_text = '...'+new_text
-                    text = self.FONT.render(new_text, True, self.color)
-
-                if self.pos=='left':
-                    screen.blit(text, (self.x+5, y))
-                elif self.pos =='center':
-                    screen.blit(text, (self.x+(self.w-text.get_rect().width)//2, y))
-                h = text.get_rect().height
-                y += h+10
+            lines = self.text
+        else:
+            return
+        for line in lines:
+            # overflowing lines keep their end: '...'+tail
+            text = render_text(self.FONT, line, self.color, self.w)
+            if self.pos=='left':
+                screen.blit(text, (self.x+5, y))
+            elif self.pos =='center':
+                screen.blit(text, (self.x+(self.w-text.get_rect().width)//2, y))
+            h = text.get_rect().height
+            y += h+10
 
     def update(self):
         pass
@@ -452,7 +497,7 @@ class Label:
 class DropDown:
     def __init__(self, x, y, w, h, options, default=0, enable=True, func=None, scrollable=False, height=0):
         self.rect = pygame.Rect(x, y, w, h)
-        self.font = pygame.font.Font(None, int(0.018*display_w))
+        self.font = get_font(0.018*display_w)
         self.options = options
         self.draw_menu = False
         self.menu_active = False
@@ -472,7 +517,7 @@ class DropDown:
 
     def draw(self, surf):
         pygame.draw.rect(surf, '#50938a' if self.enable else '#798483', self.rect, 0, border_radius=6)
-        msg = self.font.render(self.options[self.selected_option], 1, '#ffffff')
+        msg = render_text(self.font, self.options[self.selected_option], '#ffffff')
         surf.blit(msg, msg.get_rect(center = self.rect.center))
         if self.draw_menu:
             if self.scrollable:
@@ -483,14 +528,14 @@ class DropDown:
                         # rect = self.rect.copy()
                         # rect.y += (i+1) * self.rect.height
                         pygame.draw.rect(surf, '#50938a' if i == self.active_option else '#798483', offset_rect, 0)
-                        msg = self.font.render(text, 1, '#ffffff')
+                        msg = render_text(self.font, text, '#ffffff')
                         surf.blit(msg, msg.get_rect(center = offset_rect.center))
             else:
                 for i, text in enumerate(self.options):
                     rect = self.rect.copy()
                     rect.y += (i+1) * self.rect.height
                     pygame.draw.rect(surf, '#50938a' if i == self.active_option else '#798483', rect, 0)
-                    msg = self.font.render(text, 1, '#ffffff')
+                    msg = render_text(self.font, text, '#ffffff')
                     surf.blit(msg, msg.get_rect(center = rect.center))
 
     def update(self,event_list):
@@ -611,12 +656,13 @@ class Toolkit:
         icon = cv2.imread("utils/question_mark.png", -1)   
         self.w = int(0.015*display_w)
         self.icon = cv2.resize(icon, (self.w,self.w))
+        self.icon_surface = pygame.image.frombuffer(self.icon.tobytes(), (self.w,self.w), "RGBA")
         self.x = x
         self.y = y
         self.surface = surface
         self.rect = pygame.Rect(x, y, self.w, self.w)
         self.lineSpacing = 5
-        self.font = pygame.font.Font(None, int(0.012*display_w))
+        self.font = get_font(0.012*display_w)
         self.fontHeight = self.font.size("Tg")[1]
         self.text = self.wrap_text(text)
         self.text_rect = pygame.Rect(0,0,310,len(self.text)*self.fontHeight+(len(self.text)+1)*self.lineSpacing)
@@ -637,7 +683,7 @@ class Toolkit:
         return lines
     
     def draw(self):
-        self.surface.blit(pygame.image.frombuffer(self.icon.tobytes(), (self.w,self.w), "RGBA"), (self.x,self.y))
+        self.surface.blit(self.icon_surface, (self.x,self.y))
         self.update()
 
     def update(self):
@@ -649,7 +695,7 @@ class Toolkit:
             self.text_rect.y = mouse_pos[1]+10
             pygame.draw.rect(self.surface, (210,210,210), self.text_rect)
             for i, t in enumerate(self.text):
-                self.surface.blit(self.font.render(t, True, (0,0,0)), (self.text_rect.x+5, self.text_rect.y+self.lineSpacing+i*(self.lineSpacing+self.fontHeight)))
+                self.surface.blit(render_text(self.font, t, (0,0,0)), (self.text_rect.x+5, self.text_rect.y+self.lineSpacing+i*(self.lineSpacing+self.fontHeight)))
 
 class List:
     def __init__(self, x, y, w, h, height, options, enable=True, func=None):
@@ -0,0 +1,202 @@
+import os
+import bisect
+import cv2
+import numpy as np
+
+def index_path(video_name):
+    return os.path.splitext(video_name)[0]+'.index.npz'
+
+def build_index(video_name):
+    """Walks the packets of a video without decoding them and returns (frame count, keyframe positions,
+    presentation time of every packet in ms), in decode order (see presentation_order). Falls back to
+    grabbing (decoding) every frame when the backend can't return raw packets."""
+    keyframes = []
+    timestamps = []
+    cnt = 0
+    cap = cv2.VideoCapture(video_name, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1]) if hasattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME') else None
+    if cap is not None and cap.isOpened():
+        while cap.grab():
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(cnt)
+            timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+            cnt+=1
+        cap.release()
+    if cnt == 0:
+        cap = cv2.VideoCapture(video_name)
+        while cap.grab():
+            timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+            cnt+=1
+        cap.release()
+    if len(keyframes) == 0 or keyframes[0] != 0:
+        keyframes.insert(0, 0)
+    return cnt, keyframes, timestamps
+
+def presentation_order(keyframes, timestamps):
+    """Keyframe positions and time stamps of the packets of a video as frames in display order. With B-frames
+    packets come out of display order, frame k is the packet with the k-th smallest time stamp. Frames already
+    in display order are returned unchanged."""
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    order = np.argsort(timestamps, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    keyframes = sorted([int(rank[k]) if k < len(rank) else int(k) for k in keyframes])
+    return keyframes, timestamps[order]
+
+def read_index(video_name):
+    """{frame_count, keyframes, timestamps} of a video, from the index stored beside it when it is still
+    valid, otherwise builds it and tries to store it."""
+    path = index_path(video_name)
+    stat = os.stat(video_name)
+    if os.path.isfile(path):
+        try:
+            data = np.load(path)
+            ## indexes stored before the timestamps were added are rebuilt
+            if int(data['size']) == stat.st_size and float(data['mtime']) == stat.st_mtime and 'timestamps' in data:
+                ## indexes stored in decode order are reordered here
+                keyframes, timestamps = presentation_order(data['keyframes'].tolist(), data['timestamps'])
+                return {"frame_count": int(data['frame_count']), "keyframes": keyframes, "timestamps": timestamps}
+        except Exception as e:
+            print(f"Rebuilding the index of {video_name}: {e}")
+
+    frame_count, keyframes, timestamps = build_index(video_name)
+    keyframes, timestamps = presentation_order(keyframes, timestamps)
+    try:
+        with open(path, 'wb') as f:
+            np.savez(f, frame_count=np.int64(frame_count), keyframes=np.asarray(keyframes, dtype=np.int64), timestamps=timestamps, size=np.int64(stat.st_size), mtime=np.float64(stat.st_mtime))
+    except OSError as e:
+        print(f"Couldn't store the index of {video_name}: {e}")
+    return {"frame_count": frame_count, "keyframes": keyframes, "timestamps": timestamps}
+
+def load_index(video_name):
+    """Returns (frame count, keyframe positions) of a video (see read_index)"""
+    index = read_index(video_name)
+    return index["frame_count"], index["keyframes"]
+
+def load_timestamps(video_name):
+    """Presentation time of every frame of a video in seconds, from its container (see read_index)"""
+    return read_index(video_name)["timestamps"]/1000
+
+def video_fps(video_name):
+    cap = cv2.VideoCapture(video_name)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return fps if fps > 0 else 30.
+
+def frame_shape(video_name):
+    """(height, width, 3) of the decoded frames"""
+    cap = cv2.VideoCapture(video_name)
+    shape = (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+    cap.release()
+    return shape
+
+class VideoReader:
+    """cv2.VideoCapture that knows its position, skips frames with grab-only calls and seeks through a
+    keyframe index built once per video (see load_index)"""
+    def __init__(self, video_name, use_index=True):
+        self.video_name = video_name
+        self.cap = cv2.VideoCapture(video_name)
+        self.position = 0   # index of the frame returned by the next grab/read
+        if use_index:
+            self.frame_count, self.keyframes = load_index(video_name)
+        else:
+            self.frame_count, self.keyframes = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)), [0]
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def grab(self):
+        success = self.cap.grab()
+        if success:
+            self.position+=1
+        return success
+
+    def read(self):
+        success, frame = self.cap.read()
+        if success:
+            self.position+=1
+        return success, frame
+
+    def retrieve(self):
+        """Decodes the frame of the last grab"""
+        return self.cap.retrieve()
+
+    def skip(self, n):
+        """Moves n frames forward without decoding more than needed"""
+        if n > 0:
+            return self.seek(self.position+n)
+        return True
+
+    def seek(self, target):
+        """Positions the reader so that the next read returns frame `target`"""
+        if target >= self.frame_count:
+            return False
+        # closest keyframe at or before the target
+        keyframe = self.keyframes[bisect.bisect_right(self.keyframes, target)-1]
+        if target < self.position or keyframe > self.position:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+            self.position = keyframe
+        while self.position < target:
+            if not self.grab():
+                return False
+        return True
+
+    def release(self):
+        self.cap.release()
+
+class SyncedReader:
+    """Reader of one camera on the timeline of a session (see sync.session_sync): `mapping` holds the frame of
+    the video shown at each step. It has the interface of VideoReader with positions counted in steps.
+    Frames the timeline jumps over are only grabbed (or seeked over), never decoded; a frame shown at several
+    steps is decoded once."""
+    def __init__(self, video_name, mapping):
+        self.reader = VideoReader(video_name)
+        self.mapping = np.asarray(mapping, dtype=np.int64)
+        self.frame_count = len(self.mapping)
+        self.position = 0
+        self.current = -1     # video frame of the last step
+        self.frame = None     # its decoded image, None while it was only grabbed
+
+    def isOpened(self):
+        return self.reader.isOpened()
+
+    def __advance(self):
+        if self.position >= self.frame_count:
+            return False
+        target = int(self.mapping[self.position])
+        if target != self.current:
+            if not self.reader.skip(target-self.reader.position) or not self.reader.grab():
+                return False
+            self.current = target
+            self.frame = None
+        self.position+=1
+        return True
+
+    def grab(self):
+        return self.__advance()
+
+    def read(self):
+        if not self.__advance():
+            return False, None
+        if self.frame is None:
+            success, self.frame = self.reader.retrieve()
+            if not success:
+                return False, None
+        return True, self.frame
+
+    def skip(self, n):
+        if n > 0:
+            return self.seek(self.position+n)
+        return True
+
+    def seek(self, target):
+        if target >= self.frame_count:
+            return False
+        if not self.reader.seek(int(self.mapping[target])):
+            return False
+        self.position = target
+        self.current = -1
+        self.frame = None
+        return True
+
+    def release(self):
+        self.reader.release()